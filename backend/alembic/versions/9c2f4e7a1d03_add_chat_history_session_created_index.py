@@ -0,0 +1,33 @@
+"""add chat_history (session_id, created_at) index
+
+Revision ID: 9c2f4e7a1d03
+Revises: 5b37442658bc
+Create Date: 2026-10-17 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c2f4e7a1d03'
+down_revision: Union[str, Sequence[str], None] = '5b37442658bc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_chat_history_session_id_created_at',
+        'chat_history',
+        ['session_id', 'created_at'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chat_history_session_id_created_at', table_name='chat_history')
@@ -0,0 +1,58 @@
+"""add chat_history keyset pagination indexes
+
+Revision ID: e41b7d2c9a58
+Revises: 9c2f4e7a1d03
+Create Date: 2026-10-17 11:04:52.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41b7d2c9a58'
+down_revision: Union[str, Sequence[str], None] = '9c2f4e7a1d03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Built concurrently on PostgreSQL so chats keep being written meanwhile
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chat_history_session_id_created_at_id',
+            'chat_history',
+            ['session_id', 'created_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_chat_history_created_at_id',
+            'chat_history',
+            ['created_at', 'id'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        # Covered by the session index above
+        op.drop_index(
+            'ix_chat_history_session_id_created_at',
+            table_name='chat_history',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_chat_history_session_id_created_at',
+            'chat_history',
+            ['session_id', 'created_at'],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_chat_history_created_at_id', table_name='chat_history', postgresql_concurrently=True)
+        op.drop_index('ix_chat_history_session_id_created_at_id', table_name='chat_history', postgresql_concurrently=True)
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import time
+import faiss
+import numpy as np
+
+# Nearest cached questions checked on lookup, so an expired nearest one does
+# not hide a live one that is also close enough
+LOOKUP_NEIGHBOURS = 5
+
+
+@dataclass
+class CacheEntry:
+    language: str
+    question: str
+    answer: str
+    expires_at: float
+
+
+class SemanticAnswerCache:
+    """
+    Caches answers to first-turn questions and serves them for questions whose
+    embedding is close enough to one asked before in the same language.
+
+    Each language has its own small inner-product FAISS index over normalized
+    question embeddings, so scores are cosine similarities. Entries expire
+    after ttl_seconds. Once max_entries is reached, expired entries are purged
+    first, then the least recently used ones are evicted.
+    """
+
+    def __init__(self, embeddings, threshold: float = 0.92, ttl_seconds: float = 21600, max_entries: int = 2000):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._indexes = {}
+        self._entries = OrderedDict()
+        self._next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def embed(self, question: str, embed_query=None):
+        embedding = await (embed_query or self.embeddings.aembed_query)(question)
+        if embedding is None:
+            return None
+        vector = np.asarray([embedding], dtype="float32")
+        faiss.normalize_L2(vector)
+        return vector
+
+    async def lookup(self, question: str, language: str, embed_query=None):
+        """
+        Returns (answer, vector). answer is None on a miss; vector can be passed
+        to store() so the question is not embedded twice.
+
+        embed_query replaces the embeddings' aembed_query, for example with the
+        retriever's timed one (see HybridRetriever.aembed_query); if it returns
+        None the cache is bypassed.
+        """
+        try:
+            vector = await self.embed(question, embed_query)
+        except Exception as e:
+            print(f"[CACHE] Embedding failed, bypassing semantic cache: {e}")
+            return None, None
+        if vector is None:
+            return None, None
+
+        index = self._indexes.get(language)
+        if index is None or index.ntotal == 0:
+            self.misses += 1
+            return None, vector
+
+        scores, ids = index.search(vector, min(LOOKUP_NEIGHBOURS, index.ntotal))
+        now = time.monotonic()
+        for score, entry_id in zip(scores[0], ids[0]):
+            if entry_id < 0 or score < self.threshold:
+                break
+            entry = self._entries.get(int(entry_id))
+            if entry is None:
+                continue
+            if entry.expires_at <= now:
+                self._remove(int(entry_id))
+                continue
+            self._entries.move_to_end(int(entry_id))
+            self.hits += 1
+            return entry.answer, vector
+
+        self.misses += 1
+        return None, vector
+
+    def store(self, language: str, vector: np.ndarray, question: str, answer: str):
+        if vector is None:
+            return
+
+        index = self._indexes.get(language)
+        if index is None:
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            self._indexes[language] = index
+
+        entry_id = self._next_id
+        self._next_id += 1
+        index.add_with_ids(vector, np.asarray([entry_id], dtype="int64"))
+        self._entries[entry_id] = CacheEntry(
+            language=language,
+            question=question,
+            answer=answer,
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+
+        if len(self._entries) > self.max_entries:
+            self.purge_expired()
+        while len(self._entries) > self.max_entries:
+            oldest_id = next(iter(self._entries))
+            self._remove(oldest_id)
+            self.evictions += 1
+
+    def purge_expired(self):
+        now = time.monotonic()
+        for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry.expires_at <= now]:
+            self._remove(entry_id)
+
+    def clear(self):
+        self._indexes.clear()
+        self._entries.clear()
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._indexes[entry.language].remove_ids(np.asarray([entry_id], dtype="int64"))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
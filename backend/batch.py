@@ -0,0 +1,203 @@
+"""
+Answering many questions at once, for evaluation sets and content
+generation. Used by POST /chat/batch and as a command-line tool:
+
+    python batch.py questions.txt [--output answers.ndjson] [--concurrency 8] [--save-history]
+
+All questions of a batch are embedded in one batched request and searched
+with one FAISS search over the matrix of query vectors (see
+HybridRetriever.abatch_retrieve). Up to `concurrency` completions then run
+at once, and results are yielded as they complete, not in input order; each
+carries the index of its question. Questions are answered as first turns:
+no chat history and no semantic answer cache.
+
+Persisting the exchanges to chat_history is optional; rows are inserted in
+bulk, BATCH_INSERT_ROWS at a time.
+
+The input file holds one question per line, or JSON lines with "question"
+and optionally "id" and "session_id".
+"""
+from datetime import datetime, timezone
+from db import AsyncSessionLocal
+from followup import RETRIEVED_DOCUMENTS_KEY
+from language import DEFAULT_LANGUAGE
+from models import ChatHistory
+from sqlalchemy import insert
+from pathlib import Path
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+import uuid
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+BATCH_INSERT_ROWS = 500
+
+
+def detect_languages(detector, questions: list) -> list:
+    """
+    The answer language of each question, without session memory.
+    """
+    languages = []
+    for question in questions:
+        language, confidence, _ = detector.detect(question)
+        usable = language is not None and confidence >= detector.min_confidence
+        languages.append(language if usable else DEFAULT_LANGUAGE)
+    return languages
+
+
+async def answer_batch(chain, retriever, inputs: list, concurrency: int = BATCH_CONCURRENCY):
+    """
+    Yields (position, result, docs) as each answer completes. inputs are chain
+    inputs without chat history; result is the chain's output, or the
+    exception it raised.
+    """
+    docs = await retriever.abatch_retrieve([item["question"] for item in inputs])
+    slots = asyncio.Semaphore(concurrency)
+
+    async def answer(position: int):
+        async with slots:
+            try:
+                result = await chain.ainvoke({**inputs[position], RETRIEVED_DOCUMENTS_KEY: docs[position]})
+            except Exception as e:
+                result = e
+        return position, result
+
+    tasks = [asyncio.create_task(answer(position)) for position in range(len(inputs))]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            position, result = await completed
+            yield position, result, docs[position]
+    finally:
+        # The consumer went away (client disconnected): stop the remaining completions
+        for task in tasks:
+            task.cancel()
+
+
+async def save_rows(rows: list, session_factory=AsyncSessionLocal):
+    for i in range(0, len(rows), BATCH_INSERT_ROWS):
+        async with session_factory() as session:
+            await session.execute(insert(ChatHistory), rows[i:i + BATCH_INSERT_ROWS])
+            await session.commit()
+
+
+async def run_batch(chain, retriever, detector, items: list, build_inputs, concurrency: int = BATCH_CONCURRENCY, save=None, session_id: str = None):
+    """
+    Yields one result dict per item, as answers complete, then a summary with
+    "done": true.
+
+    items are dicts with "question" and optionally "id" and "session_id".
+    build_inputs(question, chat_history, language) makes the chain inputs.
+    If save is given, it is awaited with lists of chat_history rows; turns
+    are saved under the item's session_id, else under session_id.
+    """
+    started = time.perf_counter()
+    session_id = session_id or f"batch-{uuid.uuid4().hex}"
+    questions = [item["question"] for item in items]
+    languages = await asyncio.to_thread(detect_languages, detector, questions)
+    inputs = [build_inputs(question, [], language) for question, language in zip(questions, languages)]
+
+    counts = {"answered": 0, "failed": 0, "saved": 0}
+    rows = []
+    async for position, result, docs in answer_batch(chain, retriever, inputs, concurrency):
+        item = items[position]
+        line = {"index": position, "id": item.get("id"), "question": item["question"]}
+        if isinstance(result, Exception):
+            counts["failed"] += 1
+            line["error"] = str(result) or type(result).__name__
+            yield line
+            continue
+
+        counts["answered"] += 1
+        line["answer"] = result["answer"]
+        line["sources"] = list(dict.fromkeys(doc.metadata.get("source") for doc in docs))
+        yield line
+
+        if save is not None:
+            rows.append({
+                "session_id": item.get("session_id") or session_id,
+                "user_message": item["question"],
+                "bot_response": result["answer"],
+                "created_at": datetime.now(timezone.utc),
+            })
+            if len(rows) >= BATCH_INSERT_ROWS:
+                await save(rows)
+                counts["saved"] += len(rows)
+                rows = []
+
+    if rows:
+        await save(rows)
+        counts["saved"] += len(rows)
+
+    elapsed = round(time.perf_counter() - started, 3)
+    yield {"done": True, "questions": len(items), **counts, "seconds": elapsed}
+
+
+def read_questions(path: Path) -> list:
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line) if line.startswith("{") else {"question": line}
+            items.append(item)
+    return items
+
+
+async def run_file(args, out):
+    # The same chain, prompt and models as the server
+    import main as app
+    from retriever import build_retriever
+
+    items = read_questions(args.questions)
+    await asyncio.to_thread(app.language_detector.load)
+    retriever = await asyncio.to_thread(build_retriever)
+    chain = app.build_chain(retriever)
+
+    # One session for the whole file, however many batches it takes
+    session_id = args.session_id or f"batch-{uuid.uuid4().hex}"
+    totals = {"questions": 0, "answered": 0, "failed": 0, "saved": 0}
+    for offset in range(0, len(items), args.batch_size):
+        lines = run_batch(
+            chain, retriever, app.language_detector, items[offset:offset + args.batch_size],
+            app.build_chain_inputs, args.concurrency,
+            save=save_rows if args.save_history else None, session_id=session_id,
+        )
+        async for line in lines:
+            if line.get("done"):
+                for key in totals:
+                    totals[key] += line[key]
+                continue
+            line["index"] += offset
+            out.write(json.dumps(line, ensure_ascii=False) + "\n")
+            out.flush()
+    print(f"[BATCH] Done: {totals}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions, writing one JSON result per line.")
+    parser.add_argument("questions", type=Path, help="one question per line, or JSON lines with a \"question\" field")
+    parser.add_argument("--output", type=Path, help="NDJSON output file (default: stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="completions in flight")
+    parser.add_argument("--batch-size", type=int, default=BATCH_MAX_QUESTIONS, help="questions embedded and searched together")
+    parser.add_argument("--save-history", action="store_true", help="store the exchanges in chat_history")
+    parser.add_argument("--session-id", help="session of the saved exchanges (default: batch-<random>)")
+    args = parser.parse_args()
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        # Results go to out; the usual progress prints go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            asyncio.run(run_file(args, out))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
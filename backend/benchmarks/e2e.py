@@ -0,0 +1,326 @@
+"""
+Offline end-to-end benchmark of the chat service.
+
+Runs the real code paths against local stand-ins: a fake OpenAI server
+(benchmarks/fake_openai.py, in a subprocess), a fake Google Drive
+(benchmarks/fake_drive.py) holding a synthetic corpus, and SQLite. Nothing
+leaves the machine and no API keys are needed.
+
+Stages, each reported with p50/p95/p99 where it is repeated:
+
+    drive_sync      download the corpus through drive_loader, then a no-op re-sync
+    index_build     embed and index the corpus (index_builder.build_index)
+    index_load      load the compact index and retriever (retriever.build_retriever)
+    retrieval       retriever queries with unique questions (embedding + search), and BM25 alone
+    requests        POST /chat through the FastAPI app (lifespan included); each
+                    conversation asks a question and a follow-up, at each concurrency level
+
+Results are printed as JSON (or written with --output) together with the
+commit and settings, so runs can be compared across commits. Application
+logs go to stderr.
+
+Usage (from backend/):
+    python -m benchmarks.e2e [--concurrency 1 4 16] [--requests 64] [--output results.json]
+"""
+from contextlib import redirect_stdout
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+FOLDER_ID = "benchmark-folder"
+VOCABULARY = (
+    "ivan alyosha dmitri smerdyakov zosima grushenka katerina fyodor raskolnikov sonia "
+    "porfiry svidrigailov razumikhin dunya myshkin nastasya rogozhin aglaya stavrogin "
+    "god faith doubt suffering freedom conscience guilt crime punishment redemption love "
+    "soul rebellion harmony children justice truth pride humility forgiveness miracle "
+    "mystery authority bread church elder monastery prison siberia petersburg moscow "
+    "money gambling fever dream devil angel prayer tears laughter silence confession"
+).split()
+FILLER = "the a of and to in that he she it was his her with as for on at by but not".split()
+
+
+def summarize(samples: list) -> dict:
+    values = np.asarray(samples, dtype="float64") * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+
+def synthetic_book(index: int, size_kb: int) -> bytes:
+    rng = np.random.default_rng(index)
+    words, length = [], 0
+    while length < size_kb * 1024:
+        sentence = [rng.choice(VOCABULARY) if rng.random() < 0.3 else rng.choice(FILLER) for _ in range(rng.integers(8, 20))]
+        text = " ".join(sentence).capitalize() + "."
+        words.append(text)
+        length += len(text) + 1
+    paragraphs = [" ".join(words[i:i + 6]) for i in range(0, len(words), 6)]
+    return "\n\n".join(paragraphs).encode("utf-8")
+
+
+def question(index: int) -> str:
+    rng = np.random.default_rng(10_000 + index)
+    first, second = rng.choice(VOCABULARY, size=2, replace=False)
+    return f"What does the novel say about {first} and {second}? (#{index})"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def start_fake_openai(args) -> tuple:
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.fake_openai",
+            "--port", str(port),
+            "--dimension", str(args.dimension),
+            "--embed-latency-ms", str(args.embed_latency_ms),
+            "--chat-latency-ms", str(args.chat_latency_ms),
+            "--token-latency-ms", str(args.token_latency_ms),
+        ],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 20
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Fake OpenAI server did not start")
+
+
+async def stage_drive_sync(args, data_dir: Path) -> dict:
+    from benchmarks.fake_drive import FakeDriveService, patch_drive_loader
+    import drive_loader
+
+    service = FakeDriveService(latency=args.drive_latency_ms / 1000)
+    for i in range(args.books):
+        service.add_file(FOLDER_ID, f"book_{i:02d}.txt", synthetic_book(i, args.book_kb))
+    patch_drive_loader(service, FOLDER_ID)
+
+    started = time.perf_counter()
+    result = await asyncio.to_thread(drive_loader.download_missing_files)
+    first = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await asyncio.to_thread(drive_loader.download_missing_files)
+    resync = time.perf_counter() - started
+
+    size = sum(path.stat().st_size for path in data_dir.glob("*.txt"))
+    return {
+        "files": len(result["downloaded"]),
+        "bytes": size,
+        "seconds": round(first, 3),
+        "mb_per_s": round(size / 2**20 / first, 2) if first else None,
+        "resync_seconds": round(resync, 3),
+    }
+
+
+async def stage_index_build(data_dir: Path) -> dict:
+    from embedding_cache import get_embeddings
+    from index_builder import INDEX_DIR, build_index
+
+    started = time.perf_counter()
+    store = await build_index(INDEX_DIR, data_dir=data_dir, embeddings=get_embeddings())
+    seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await build_index(INDEX_DIR, data_dir=data_dir, embeddings=get_embeddings())
+    noop = time.perf_counter() - started
+
+    chunks = store.index.ntotal
+    return {
+        "chunks": chunks,
+        "seconds": round(seconds, 3),
+        "chunks_per_s": round(chunks / seconds, 1) if seconds else None,
+        "noop_rebuild_seconds": round(noop, 3),
+    }
+
+
+async def stage_index_load(loads: int):
+    from retriever import build_retriever
+
+    samples, retriever = [], None
+    for _ in range(loads):
+        started = time.perf_counter()
+        retriever = await asyncio.to_thread(build_retriever)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples), retriever
+
+
+async def stage_retrieval(retriever, queries: int) -> dict:
+    full, lexical = [], []
+    for i in range(queries):
+        text = question(100_000 + i)
+        started = time.perf_counter()
+        await retriever.ainvoke(text)
+        full.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        retriever.lexical_search(text, retriever.k)
+        lexical.append(time.perf_counter() - started)
+    return {"retriever": summarize(full), "bm25": summarize(lexical)}
+
+
+async def stage_requests(args) -> dict:
+    import httpx
+    import main
+    import models
+    from db import engine
+
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+
+    results = {}
+    async with main.lifespan(main.app):
+        started = time.perf_counter()
+        while not main.startup_state["ready"]:
+            if time.perf_counter() - started > 120:
+                raise RuntimeError(f"App did not become ready: {main.startup_state['error']}")
+            await asyncio.sleep(0.05)
+        results["startup_seconds"] = round(time.perf_counter() - started, 3)
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+            for level, concurrency in enumerate(args.concurrency):
+                slots = asyncio.Semaphore(concurrency)
+                first_turn, follow_up, errors = [], [], 0
+
+                async def ask(session_id: str, text: str, samples: list):
+                    nonlocal errors
+                    started = time.perf_counter()
+                    response = await client.post("/chat", json={"session_id": session_id, "question": text})
+                    samples.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        errors += 1
+
+                async def conversation(i: int):
+                    async with slots:
+                        session_id = f"bench-{level}-{i}"
+                        await ask(session_id, question(level * 10_000 + i), first_turn)
+                        await ask(session_id, "And what happens to him afterwards?", follow_up)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(conversation(i) for i in range(max(1, args.requests // 2))))
+                wall = time.perf_counter() - started
+
+                total = len(first_turn) + len(follow_up)
+                results[f"concurrency_{concurrency}"] = {
+                    "requests": total,
+                    "errors": errors,
+                    "throughput_rps": round(total / wall, 2),
+                    "all": summarize(first_turn + follow_up),
+                    "first_turn": summarize(first_turn),
+                    "follow_up": summarize(follow_up),
+                }
+
+            results["app_stats"] = (await client.get("/stats")).json()
+    return results
+
+
+async def run(args, workdir: Path) -> dict:
+    data_dir = workdir / "data"
+    stages = {}
+    stages["drive_sync"] = await stage_drive_sync(args, data_dir)
+    stages["index_build"] = await stage_index_build(data_dir)
+    stages["index_load"], retriever = await stage_index_load(args.loads)
+    stages["retrieval"] = await stage_retrieval(retriever, args.queries)
+    stages["requests"] = await stage_requests(args)
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with fake OpenAI and Drive.")
+    parser.add_argument("--books", type=int, default=4)
+    parser.add_argument("--book-kb", type=int, default=200, help="size of each synthetic book")
+    parser.add_argument("--loads", type=int, default=5, help="index loads to time")
+    parser.add_argument("--queries", type=int, default=100, help="retrieval queries to time")
+    parser.add_argument("--requests", type=int, default=64, help="/chat requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--dimension", type=int, default=256, help="fake embedding dimension")
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--chat-latency-ms", type=float, default=300)
+    parser.add_argument("--token-latency-ms", type=float, default=5)
+    parser.add_argument("--drive-latency-ms", type=float, default=20)
+    parser.add_argument("--workdir", type=Path, help="keep files here instead of a temporary directory")
+    parser.add_argument("--output", type=Path, help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    output_path = args.output.resolve() if args.output else None
+    workdir = (args.workdir or Path(tempfile.mkdtemp(prefix="chat-benchmark-"))).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    fake_openai, base_url = start_fake_openai(args)
+
+    # Must be set before any application module is imported
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": base_url,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir / 'chat.sqlite3'}",
+        "DATA_DIR": str(workdir / "data"),
+        "EMBEDDING_CACHE_PATH": str(workdir / "embedding_cache.sqlite3"),
+        "INDEX_LOCAL_ONLY": "true",
+        "LANGCHAIN_TRACING_V2": "false",
+    })
+    os.chdir(workdir)
+
+    try:
+        with redirect_stdout(sys.stderr):
+            from embedding_cache import get_embeddings
+            # Token-length checks need tiktoken's encodings, which are downloaded on first use
+            get_embeddings().underlying.check_embedding_ctx_length = False
+            stages = asyncio.run(run(args, workdir))
+    finally:
+        fake_openai.terminate()
+        fake_openai.wait()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "settings": {key: (str(value) if isinstance(value, Path) else value) for key, value in vars(args).items()},
+        "stages": stages,
+    }
+    output = json.dumps(report, indent=2)
+    if output_path:
+        output_path.write_text(output + "\n", encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
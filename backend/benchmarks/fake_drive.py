@@ -0,0 +1,96 @@
+"""
+In-memory stand-in for the Google Drive v3 service, for offline benchmarks.
+
+Implements what DriveSyncEngine (drive_sync.py) uses: paged files().list()
+and files().get_media() with Range requests, plus optional per-request
+latency. Install it with patch_drive_loader() so drive_loader.py functions
+use it instead of the real API.
+"""
+import hashlib
+import re
+import time
+
+FOLDER_RE = re.compile(r"'([^']+)' in parents")
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)")
+
+
+class FakeRequest:
+    def __init__(self, execute, latency: float):
+        self._execute = execute
+        self.latency = latency
+        self.headers = {}
+
+    def execute(self, http=None, num_retries: int = 0):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._execute(self.headers)
+
+
+class FakeFiles:
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q: str = "", fields: str = None, pageSize: int = 100, pageToken: str = None, **kwargs):
+        def execute(headers):
+            match = FOLDER_RE.search(q)
+            folder = self.drive.folders.get(match.group(1) if match else None, {})
+            names = sorted(folder)
+            start = int(pageToken or 0)
+            page = names[start:start + pageSize]
+            response = {"files": [self.drive.metadata(folder[name]) for name in page]}
+            if start + pageSize < len(names):
+                response["nextPageToken"] = str(start + pageSize)
+            return response
+        return FakeRequest(execute, self.drive.latency)
+
+    def get_media(self, fileId: str, **kwargs):
+        def execute(headers):
+            content = self.drive.files_by_id[fileId]["content"]
+            match = RANGE_RE.match(headers.get("Range", ""))
+            if match:
+                return content[int(match.group(1)):int(match.group(2)) + 1]
+            return content
+        return FakeRequest(execute, self.drive.latency)
+
+
+class FakeDriveService:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.files_by_id = {}
+        self.folders = {}
+
+    def files(self):
+        return FakeFiles(self)
+
+    def add_file(self, folder_id: str, name: str, content: bytes, mime_type: str = "text/plain") -> str:
+        file_id = f"file-{len(self.files_by_id)}"
+        self.files_by_id[file_id] = {
+            "id": file_id,
+            "name": name,
+            "mimeType": mime_type,
+            "content": content,
+            "md5Checksum": hashlib.md5(content).hexdigest(),
+            "modifiedTime": "2024-01-01T00:00:00.000Z",
+        }
+        self.folders.setdefault(folder_id, {})[name] = file_id
+        return file_id
+
+    def metadata(self, file_id: str) -> dict:
+        file = self.files_by_id[file_id]
+        return {
+            "id": file["id"],
+            "name": file["name"],
+            "md5Checksum": file["md5Checksum"],
+            "modifiedTime": file["modifiedTime"],
+            "size": str(len(file["content"])),
+        }
+
+
+def patch_drive_loader(service: FakeDriveService, folder_id: str):
+    """
+    Points drive_loader at the fake service and folder.
+    """
+    import drive_loader
+    drive_loader.GOOGLE_DRIVE_FOLDER_ID = folder_id
+    drive_loader.get_drive_service = lambda: service
+    drive_loader.new_authorized_http = lambda: None
@@ -0,0 +1,163 @@
+"""
+Local stand-in for the OpenAI API, for offline benchmarks.
+
+Serves /v1/embeddings and /v1/chat/completions (plain and streamed) with
+configurable latency and deterministic output:
+
+- embeddings use the hashing trick (each word adds a fixed pseudo-random
+  vector), so texts sharing words get similar vectors and retrieval behaves
+  plausibly without a model
+- chat answers are a fixed number of words derived from a hash of the prompt
+
+Usage (from backend/):
+    python -m benchmarks.fake_openai --port 18080 --chat-latency-ms 300
+Then point the app at it with OPENAI_BASE_URL=http://127.0.0.1:18080/v1.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from functools import lru_cache
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import re
+import time
+import numpy as np
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+ANSWER_WORDS = (
+    "suffering freedom faith doubt conscience guilt redemption love god man soul "
+    "rebellion harmony children justice truth pride humility forgiveness"
+).split()
+
+
+def seed_of(text: str) -> int:
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+@lru_cache(maxsize=100000)
+def word_vector(word: str, dimension: int) -> np.ndarray:
+    return np.random.default_rng(seed_of(word)).standard_normal(dimension).astype("float32")
+
+
+def embed_text(text: str, dimension: int) -> np.ndarray:
+    vector = np.zeros(dimension, dtype="float32")
+    for word in WORD_RE.findall(text.lower()):
+        vector += word_vector(word, dimension)
+    norm = np.linalg.norm(vector)
+    if not norm:
+        return word_vector("", dimension) / np.linalg.norm(word_vector("", dimension))
+    return vector / norm
+
+
+def answer_text(prompt: str, words: int) -> str:
+    rng = np.random.default_rng(seed_of(prompt))
+    return " ".join(rng.choice(ANSWER_WORDS, size=words))
+
+
+def create_app(
+    dimension: int = 256,
+    embed_latency_ms: float = 50,
+    chat_latency_ms: float = 300,
+    token_latency_ms: float = 5,
+    answer_words: int = 60,
+) -> FastAPI:
+    app = FastAPI()
+    calls = {"embeddings": 0, "embedded_texts": 0, "chat": 0}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"]
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        calls["embeddings"] += 1
+        calls["embedded_texts"] += len(inputs)
+        await asyncio.sleep(embed_latency_ms / 1000)
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = embed_text(text if isinstance(text, str) else json.dumps(text), body.get("dimensions") or dimension)
+            if body.get("encoding_format") == "base64":
+                encoded = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                encoded = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": encoded})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        calls["chat"] += 1
+        prompt = json.dumps(body["messages"], sort_keys=True)
+        words = answer_text(prompt, answer_words).split(" ")
+        completion_id = f"chatcmpl-{seed_of(prompt):08x}"
+        await asyncio.sleep(chat_latency_ms / 1000)
+
+        if not body.get("stream"):
+            await asyncio.sleep(token_latency_ms * len(words) / 1000)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(words), "total_tokens": len(prompt) // 4 + len(words)},
+            }
+
+        async def chunks():
+            def chunk(delta: dict, finish_reason=None):
+                return "data: " + json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }) + "\n\n"
+
+            for i, word in enumerate(words):
+                yield chunk({"content": word if i == 0 else " " + word})
+                await asyncio.sleep(token_latency_ms / 1000)
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.get("/calls")
+    async def call_counts():
+        return calls
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--dimension", type=int, default=256)
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--chat-latency-ms", type=float, default=300, help="time to first token")
+    parser.add_argument("--token-latency-ms", type=float, default=5)
+    parser.add_argument("--answer-words", type=int, default=60)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(
+        create_app(args.dimension, args.embed_latency_ms, args.chat_latency_ms, args.token_latency_ms, args.answer_words),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
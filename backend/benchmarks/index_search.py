@@ -0,0 +1,122 @@
+"""
+Compares serving index types (see index_types.py) against exact flat search.
+
+For each configuration it reports build time, recall@k against the exact
+full-dimension flat index, single-query latency percentiles and the size of
+the serialized index (what is mapped into memory at serving time).
+
+Queries are corpus vectors with a little noise added, so no embedding calls
+are made.
+
+Usage (from backend/):
+    python -m benchmarks.index_search [--index faiss_index/index.faiss]
+    python -m benchmarks.index_search --synthetic 50000 1536 --json
+"""
+from index_types import IndexSpec, build_serving_index, reduce_dimensions
+from pathlib import Path
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+
+CONFIGS = [
+    IndexSpec("flat"),
+    IndexSpec("flat", float16=True),
+    IndexSpec("flat", dimensions=512),
+    IndexSpec("ivf_flat"),
+    IndexSpec("ivf_flat", float16=True),
+    IndexSpec("ivf_pq"),
+    IndexSpec("hnsw"),
+    IndexSpec("hnsw", float16=True),
+    IndexSpec("hnsw", dimensions=512, float16=True),
+]
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        count, dimension = args.synthetic
+        rng = np.random.default_rng(args.seed)
+        vectors = rng.standard_normal((count, dimension)).astype("float32")
+    else:
+        index = faiss.read_index(str(args.index))
+        vectors = index.reconstruct_n(0, index.ntotal)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def make_queries(vectors: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)
+    queries = vectors[picks] + noise * rng.standard_normal((len(picks), vectors.shape[1])).astype("float32")
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def percentile_ms(samples: list, q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def run_config(spec: IndexSpec, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    started = time.perf_counter()
+    index, factory = build_serving_index(vectors, spec)
+    build_seconds = time.perf_counter() - started
+
+    search_queries = reduce_dimensions(queries, spec.dimensions)
+    found = np.empty((len(queries), k), dtype="int64")
+    latencies = []
+    for i, query in enumerate(search_queries):
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - started)
+        found[i] = ids[0]
+
+    recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+    return {
+        "config": spec.label(),
+        "factory": factory,
+        "build_s": round(build_seconds, 2),
+        f"recall@{k}": round(float(recall), 4),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99),
+        "memory_mb": round(faiss.serialize_index(index).nbytes / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS serving index types.")
+    parser.add_argument("--index", type=Path, default=Path("faiss_index/index.faiss"), help="exact index to read vectors from")
+    parser.add_argument("--synthetic", type=int, nargs=2, metavar=("COUNT", "DIM"), help="use random vectors instead")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.05, help="noise added to the sampled query vectors")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=1, help="FAISS OpenMP threads")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = [run_config(spec, vectors, queries, truth, args.k) for spec in CONFIGS]
+
+    if args.json:
+        print(json.dumps({"vectors": len(vectors), "dimension": vectors.shape[1], "results": results}, indent=2))
+        return
+
+    print(f"{len(vectors)} vectors, dimension {vectors.shape[1]}, {len(queries)} queries")
+    columns = list(results[0].keys())
+    widths = [max(len(column), *(len(str(row[column])) for row in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Compares LanguageDetector (language.py) with the bare langdetect.detect call
+it replaced.
+
+Reports, for each: profile loading time plus the first call, per-call latency
+percentiles, accuracy on a small labelled set of chat questions (short and
+long, English / Portuguese / Italian) and how many questions got different
+answers across repeated runs.
+
+Accuracy counts the language the answer would actually be written in, so a
+langdetect result outside the supported languages counts as English, as it
+did in main.py.
+
+Usage (from backend/):
+    python -m benchmarks.language_detection [--repeats 20] [--json]
+"""
+from language import DEFAULT_LANGUAGE, LANGUAGE_NAMES, LanguageDetector
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+
+QUESTIONS = [
+    ("en", "What does Ivan say about suffering?"),
+    ("en", "Explain the Grand Inquisitor's argument about freedom"),
+    ("en", "Why does the Grand Inquisitor reject Christ?"),
+    ("en", "What is the significance of the kiss at the end?"),
+    ("en", "Why?"),
+    ("en", "And Alyosha?"),
+    ("en", "Who is Smerdyakov?"),
+    ("en", "Is God dead?"),
+    ("pt", "O que Ivan diz sobre o sofrimento?"),
+    ("pt", "Qual é o sentido da liberdade para Dostoiévski?"),
+    ("pt", "Fale sobre o Grande Inquisidor"),
+    ("pt", "E o Ivan?"),
+    ("pt", "Quem é Aliócha?"),
+    ("pt", "Por quê?"),
+    ("pt", "Explique a relação entre fé e dúvida"),
+    ("pt", "Deus existe?"),
+    ("it", "Cosa dice Ivan sulla sofferenza?"),
+    ("it", "Qual è il significato del bacio alla fine?"),
+    ("it", "Chi è Alëša?"),
+    ("it", "E la libertà?"),
+    ("it", "Perché il Grande Inquisitore rifiuta Cristo?"),
+    ("it", "Spiegami il rapporto tra fede e dubbio"),
+    ("it", "Dio esiste?"),
+]
+
+
+def answer_language(code: str) -> str:
+    return code if code in LANGUAGE_NAMES else DEFAULT_LANGUAGE
+
+
+def percentiles_us(samples: list) -> dict:
+    return {f"p{q}_us": round(float(np.percentile(samples, q)) * 1e6, 1) for q in (50, 95, 99)}
+
+
+def run(name: str, detect, repeats: int, load=None) -> dict:
+    started = time.perf_counter()
+    if load is not None:
+        load()
+    detect(QUESTIONS[0][1])
+    first_call = time.perf_counter() - started
+
+    latencies, correct, unstable = [], 0, 0
+    for expected, question in QUESTIONS:
+        answers = set()
+        for _ in range(repeats):
+            started = time.perf_counter()
+            try:
+                code = detect(question)
+            except Exception:
+                code = DEFAULT_LANGUAGE
+            latencies.append(time.perf_counter() - started)
+            answers.add(answer_language(code))
+        unstable += len(answers) > 1
+        correct += answers == {expected}
+
+    return {
+        "detector": name,
+        "first_call_ms": round(first_call * 1000, 1),
+        **percentiles_us(latencies),
+        "accuracy": round(correct / len(QUESTIONS), 3),
+        "unstable": unstable,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark answer-language detection.")
+    parser.add_argument("--repeats", type=int, default=20, help="runs per question")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    from langdetect import detect
+    results = [run("langdetect.detect", detect, args.repeats)]
+
+    detector = LanguageDetector()
+
+    def stateless(question: str) -> str:
+        language, confidence, _ = detector.detect(question)
+        return language if language and confidence >= detector.min_confidence else DEFAULT_LANGUAGE
+
+    results.append(run("LanguageDetector.detect", stateless, args.repeats, load=detector.load))
+
+    # Follow-up turns of a session whose language is already known
+    loop = asyncio.new_event_loop()
+    for expected, question in QUESTIONS:
+        detector._remember(question, expected)
+    results.append(run(
+        "LanguageDetector follow-up",
+        lambda question: loop.run_until_complete(detector.detect_for_session(question, question)),
+        args.repeats,
+    ))
+    loop.close()
+
+    if args.json:
+        print(json.dumps({"questions": len(QUESTIONS), "results": results}, indent=2))
+        return
+
+    print(f"{len(QUESTIONS)} questions x {args.repeats} runs")
+    columns = list(results[0].keys())
+    widths = [max(len(column), *(len(str(row[column])) for row in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Per-worker memory of a multi-worker deployment, with and without preloading
+the index in the gunicorn master (see gunicorn.conf.py).
+
+Builds a synthetic corpus and index in a temporary directory, then for each
+mode starts `gunicorn main:app -c gunicorn.conf.py` with the given number of
+workers against the fake OpenAI server (benchmarks/fake_openai.py), waits
+until every worker is ready, sends some chats so the index is actually
+searched, and reads each process's /proc/<pid>/smaps_rollup (Linux only).
+
+Reported per process: RSS, PSS (shared pages divided among the processes
+sharing them) and private memory. The sum of PSS over the master and the
+workers is the memory the deployment really uses.
+
+Usage (from backend/):
+    python -m benchmarks.worker_memory [--workers 4] [--index-type hnsw] [--json]
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.e2e import free_port, question, start_fake_openai, synthetic_book
+
+MODES = {"per_worker": "false", "preload": "true"}
+
+
+def memory_of(pid: int) -> dict:
+    """
+    RSS, PSS and private memory of a process in MB, from smaps_rollup.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_mb": round(fields["Rss"] / 1024, 1),
+        "pss_mb": round(fields["Pss"] / 1024, 1),
+        "private_mb": round((fields["Private_Clean"] + fields["Private_Dirty"]) / 1024, 1),
+    }
+
+
+def build_corpus(args, workdir: Path, env: dict):
+    data_dir = workdir / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(args.books):
+        (data_dir / f"book_{i:02d}.txt").write_bytes(synthetic_book(i, args.book_kb))
+
+    # Build in a child process so this one never imports the application
+    script = (
+        "import asyncio, models\n"
+        "from db import engine\n"
+        "from embedding_cache import get_embeddings\n"
+        "from index_builder import INDEX_DIR, build_index\n"
+        "from retriever import build_retriever\n"
+        "get_embeddings().underlying.check_embedding_ctx_length = False\n"
+        "async def tables():\n"
+        "    async with engine.begin() as conn:\n"
+        "        await conn.run_sync(models.Base.metadata.create_all)\n"
+        "asyncio.run(tables())\n"
+        f"asyncio.run(build_index(INDEX_DIR, data_dir={str(data_dir)!r}, embeddings=get_embeddings()))\n"
+        "build_retriever()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=workdir, env=env, check=True, stdout=sys.stderr)
+
+
+async def measure(mode: str, args, workdir: Path, env: dict) -> dict:
+    import httpx
+
+    port = free_port()
+    env = {**env, "PRELOAD_INDEX": MODES[mode], "WEB_CONCURRENCY": str(args.workers), "PORT": str(port)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", str(BACKEND_DIR / "gunicorn.conf.py")],
+        cwd=workdir, env=env, stdout=sys.stderr, stderr=sys.stderr,
+    )
+    try:
+        # No keep-alive, and concurrent probes: an idle server hands sequential
+        # connections to the same one or two workers
+        limits = httpx.Limits(max_keepalive_connections=0)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits) as client:
+
+            async def probe():
+                try:
+                    response = await client.get("/readyz")
+                    return response.json()["worker_pid"] if response.status_code == 200 else None
+                except httpx.TransportError:
+                    return None
+
+            started = time.perf_counter()
+            ready_workers = set()
+            while len(ready_workers) < args.workers:
+                if time.perf_counter() - started > args.startup_timeout:
+                    raise RuntimeError(f"Only {len(ready_workers)} of {args.workers} workers became ready")
+                ready_workers.update(await asyncio.gather(*(probe() for _ in range(4 * args.workers))))
+                ready_workers.discard(None)
+                await asyncio.sleep(0.05)
+            ready_seconds = time.perf_counter() - started
+
+            chats = [
+                client.post("/chat", json={"session_id": f"{mode}-{i}", "question": question(i)})
+                for i in range(args.chats)
+            ]
+            responses = await asyncio.gather(*chats)
+            errors = sum(response.status_code != 200 for response in responses)
+
+        workers = [memory_of(pid) for pid in sorted(ready_workers)]
+        master = memory_of(server.pid)
+        return {
+            "mode": mode,
+            "ready_seconds": round(ready_seconds, 2),
+            "chat_errors": errors,
+            "master": master,
+            "worker_rss_mb": round(sum(w["rss_mb"] for w in workers) / len(workers), 1),
+            "worker_pss_mb": round(sum(w["pss_mb"] for w in workers) / len(workers), 1),
+            "worker_private_mb": round(sum(w["private_mb"] for w in workers) / len(workers), 1),
+            "total_pss_mb": round(master["pss_mb"] + sum(w["pss_mb"] for w in workers), 1),
+            "workers": workers,
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-worker memory with and without index preloading.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--books", type=int, default=8)
+    parser.add_argument("--book-kb", type=int, default=500, help="size of each synthetic book")
+    parser.add_argument("--dimension", type=int, default=1536, help="embedding dimension")
+    parser.add_argument("--index-type", default="flat", help="FAISS_INDEX_TYPE of the serving index")
+    parser.add_argument("--chats", type=int, default=40, help="chats sent before measuring")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+    # The fake OpenAI server's latencies don't matter here
+    args.embed_latency_ms = args.chat_latency_ms = args.token_latency_ms = 0
+
+    workdir = Path(tempfile.mkdtemp(prefix="worker-memory-"))
+    fake_openai, base_url = start_fake_openai(args)
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(BACKEND_DIR),
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": base_url,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir / 'chat.sqlite3'}",
+        "DATA_DIR": str(workdir / "data"),
+        "EMBEDDING_CACHE_PATH": str(workdir / "embedding_cache.sqlite3"),
+        "INDEX_LOCAL_ONLY": "true",
+        "FAISS_INDEX_TYPE": args.index_type,
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "LANGCHAIN_TRACING_V2": "false",
+    }
+    try:
+        build_corpus(args, workdir, env)
+        results = [asyncio.run(measure(mode, args, workdir, env)) for mode in MODES]
+    finally:
+        fake_openai.terminate()
+        fake_openai.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps({"workers": args.workers, "index_type": args.index_type, "results": results}, indent=2))
+        return
+
+    print(f"{args.workers} workers, {args.books} x {args.book_kb} KB corpus, {args.dimension}-d {args.index_type} index")
+    columns = ["mode", "ready_seconds", "worker_rss_mb", "worker_pss_mb", "worker_private_mb", "total_pss_mb", "chat_errors"]
+    widths = [max(len(column), *(len(str(row[column])) for row in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[column]).ljust(width) for column, width in zip(columns, widths)))
+
+
+if __name__ == "__main__":
+    main()
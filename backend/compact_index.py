@@ -0,0 +1,274 @@
+"""
+Compact, pickle-free on-disk format for the FAISS index.
+
+A compact index directory holds:
+
+    vectors.faiss   FAISS index, memory-mapped at load time
+    chunks.npy      one (file, start, offset, length) record per vector,
+                    memory-mapped; offset/length are bytes into texts.bin
+    texts.bin       UTF-8 text of each book, with overlapping chunks merged
+                    back into contiguous segments so the overlap is stored once
+    meta.json       format version, vector count, index spec (see
+                    index_types.py) and per-file metadata
+    bm25*           BM25 lexical index over the same chunks (see lexical_index.py)
+
+Chunks are only decoded when a search returns them, so cold start and RSS
+scale with what is actually read rather than with corpus size.
+"""
+from collections.abc import Mapping
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from index_types import IndexSpec, TruncatedEmbeddings, build_serving_index, configure_search
+from lexical_index import BM25Index
+from pathlib import Path
+import json
+import mmap
+import os
+import shutil
+import faiss
+import numpy as np
+
+COMPACT_FORMAT_VERSION = 1
+
+RECORD_DTYPE = np.dtype([
+    ("file", "<u4"),
+    ("start", "<u8"),
+    ("offset", "<u8"),
+    ("length", "<u4"),
+])
+
+
+def is_compact_index(index_dir: Path) -> bool:
+    return (Path(index_dir) / "meta.json").exists()
+
+
+def compact_index_spec(index_dir: Path):
+    """
+    Returns the IndexSpec a compact index was built with, or None if there is none.
+    """
+    if not is_compact_index(index_dir):
+        return None
+    with open(Path(index_dir) / "meta.json", "r", encoding="utf-8") as f:
+        return IndexSpec.from_dict(json.load(f).get("index", {}))
+
+
+def read_index_mmap(path: Path):
+    """
+    Reads a FAISS index memory-mapped when the index type supports it.
+    """
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(str(path), flags)
+    except RuntimeError:
+        return faiss.read_index(str(path))
+
+
+class PositionalIds(Mapping):
+    """
+    index_to_docstore_id for a compact index: vector i maps to document "i".
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.size:
+            raise KeyError(position)
+        return str(position)
+
+    def __iter__(self):
+        return iter(range(self.size))
+
+    def __len__(self):
+        return self.size
+
+
+class CompactDocstore(Docstore):
+    """
+    Read-only docstore decoding chunks on demand from chunks.npy and texts.bin.
+    """
+
+    def __init__(self, index_dir: Path):
+        index_dir = Path(index_dir)
+        with open(index_dir / "meta.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.files = self.meta["files"]
+        self.records = np.load(index_dir / "chunks.npy", mmap_mode="r")
+
+        self._blob_file = open(index_dir / "texts.bin", "rb")
+        if os.fstat(self._blob_file.fileno()).st_size:
+            self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._blob = b""
+
+    def search(self, search: str):
+        position = int(search)
+        if not 0 <= position < len(self.records):
+            return f"ID {search} not found."
+
+        record = self.records[position]
+        offset, length = int(record["offset"]), int(record["length"])
+        file = self.files[int(record["file"])]
+        return Document(
+            id=search,
+            page_content=self._blob[offset:offset + length].decode("utf-8"),
+            metadata={**file, "start_index": int(record["start"])},
+        )
+
+    def __len__(self):
+        return len(self.records)
+
+
+def _pack_segments(blob, records, docs: list, positions: list, file_id: int):
+    """
+    Writes the chunks of one file to the blob, merging chunks that overlap
+    their predecessor into a single segment.
+    """
+    positions = sorted(positions, key=lambda p: docs[p].metadata.get("start_index", -1))
+
+    segment, segment_start, members = "", None, []
+
+    def flush():
+        if not members:
+            return
+        base = len(blob)
+        byte_pos, char_pos = 0, 0
+        for position, rel_start, text in members:
+            byte_pos += len(segment[char_pos:rel_start].encode("utf-8"))
+            char_pos = rel_start
+            records[position] = (file_id, segment_start + rel_start, base + byte_pos, len(text.encode("utf-8")))
+        blob.extend(segment.encode("utf-8"))
+
+    for position in positions:
+        text = docs[position].page_content
+        start = docs[position].metadata.get("start_index")
+
+        if start is None or start < 0:
+            # No offset to merge on: store the chunk as its own segment
+            flush()
+            segment, segment_start, members = text, 0, [(position, 0, text)]
+            flush()
+            segment, segment_start, members = "", None, []
+            continue
+
+        if segment_start is not None:
+            rel_start = start - segment_start
+            overlap = segment[rel_start:]
+            if 0 <= rel_start <= len(segment) and text.startswith(overlap):
+                segment += text[len(overlap):]
+                members.append((position, rel_start, text))
+                continue
+
+        flush()
+        segment, segment_start, members = text, start, [(position, 0, text)]
+
+    flush()
+
+
+def check_vectors(store: FAISS, index, ids: list, records, blob, spec: IndexSpec, samples: int = 32):
+    """
+    Fails unless the serving index holds one vector per chunk, in chunk
+    order: for sampled rows, the text written for the row is the text of
+    the chunk the row was exported from and, for exact specs, the row's
+    vector is that chunk's vector in the store.
+    """
+    if index.ntotal != len(ids):
+        raise ValueError(f"Serving index has {index.ntotal} vectors for {len(ids)} chunks")
+    if not ids:
+        return
+    exact = spec.index_type == "flat" and not spec.dimensions and not spec.float16
+    store_positions = {docstore_id: position for position, docstore_id in store.index_to_docstore_id.items()}
+    for row in np.linspace(0, len(ids) - 1, min(samples, len(ids))).astype(int):
+        offset, length = int(records[row]["offset"]), int(records[row]["length"])
+        if bytes(blob[offset:offset + length]).decode("utf-8") != store.docstore.search(ids[row]).page_content:
+            raise ValueError(f"Chunk {row} was written with the text of another chunk")
+        if exact and not np.array_equal(index.reconstruct(int(row)), store.index.reconstruct(store_positions[ids[row]])):
+            raise ValueError(f"Vector {row} of the serving index is not the vector of its chunk")
+
+
+def export_compact(store: FAISS, out_dir: Path, spec: IndexSpec = None, positions: list = None) -> Path:
+    """
+    Writes a FAISS vector store in the compact format, replacing out_dir atomically.
+    The store's exact vectors are turned into a serving index of the given spec.
+    If positions is given, only those vectors of the store are exported (one
+    shard, see sharded_index.py).
+    """
+    out_dir = Path(out_dir)
+    spec = spec or IndexSpec()
+    if positions is None:
+        positions = range(store.index.ntotal)
+    count = len(positions)
+    ids = [store.index_to_docstore_id[i] for i in positions]
+    docs = [store.docstore.search(docstore_id) for docstore_id in ids]
+
+    files, file_ids, by_file = [], {}, {}
+    for position, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("author"))
+        if key not in file_ids:
+            file_ids[key] = len(files)
+            files.append({"source": key[0], "author": key[1]})
+        by_file.setdefault(file_ids[key], []).append(position)
+
+    blob = bytearray()
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+    for file_id, file_positions in by_file.items():
+        _pack_segments(blob, records, docs, file_positions, file_id)
+
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    if isinstance(positions, range) and (not count or spec == IndexSpec()):
+        index, factory = store.index, "Flat"
+    else:
+        vectors = store.index.reconstruct_batch(np.asarray(positions, dtype="int64"))
+        index, factory = build_serving_index(vectors, spec)
+    check_vectors(store, index, ids, records, blob, spec)
+    faiss.write_index(index, str(tmp_dir / "vectors.faiss"))
+    np.save(tmp_dir / "chunks.npy", records)
+    BM25Index.build([doc.page_content for doc in docs]).save(tmp_dir)
+    with open(tmp_dir / "texts.bin", "wb") as f:
+        f.write(blob)
+    with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "format": COMPACT_FORMAT_VERSION,
+            "count": count,
+            "dimension": index.d,
+            "index": spec.to_dict(),
+            "factory": factory,
+            "files": files,
+        }, f, ensure_ascii=False, indent=2)
+
+    # Swap directories; processes that still map the old files keep their inodes
+    old_dir = out_dir.with_name(out_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_dir.exists():
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    text_bytes = sum(len(doc.page_content.encode("utf-8")) for doc in docs)
+    print(f"[COMPACT] Wrote {count} chunks to {out_dir} as {spec.label()} ({len(blob)} text bytes, {text_bytes} before merging overlaps)")
+    return out_dir
+
+
+def load_compact(index_dir: Path, embeddings) -> FAISS:
+    index_dir = Path(index_dir)
+    index = read_index_mmap(index_dir / "vectors.faiss")
+    docstore = CompactDocstore(index_dir)
+    if len(docstore) != index.ntotal:
+        raise ValueError(f"Compact index at {index_dir} is inconsistent: {index.ntotal} vectors, {len(docstore)} chunks")
+
+    spec = IndexSpec.from_dict(docstore.meta.get("index", {}))
+    configure_search(index, spec)
+    if spec.dimensions:
+        # Queries must be reduced the same way as the indexed vectors
+        embeddings = TruncatedEmbeddings(embeddings, index.d)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=PositionalIds(index.ntotal),
+    )
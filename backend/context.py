@@ -0,0 +1,172 @@
+"""
+Packing of retrieved chunks into the prompt's {context}.
+
+Chunks are 1000 characters with 200 of overlap, so two hits that are
+neighbours in the same book repeat text, and passages that appear more than
+once in the corpus are sent twice. pack_context, in order:
+
+1. merges chunks of the same file that overlap or touch, using their
+   start_index, into one passage (ranked where its best chunk was)
+2. drops passages whose word 3-grams are mostly contained in a better
+   ranked passage (overlap coefficient >= duplicate_threshold)
+3. keeps passages in rank order while they fit the token budget; the first
+   one that doesn't fit is cut at a word boundary if enough budget is left
+
+The tokens saved per request are recorded in ContextStats (/stats) and in
+metrics.py.
+"""
+from collections import deque
+from langchain_core.documents import Document
+from tokens import count_tokens
+import re
+import numpy as np
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# A passage is only cut to fit the budget if at least this many tokens remain
+MIN_PARTIAL_TOKENS = 64
+
+
+def merge_overlapping(docs: list) -> tuple:
+    """
+    Returns (passages, merged_count). Chunks without a start_index are kept as is.
+    """
+    passages, by_source = [], {}
+    for rank, doc in enumerate(docs):
+        start = doc.metadata.get("start_index")
+        if isinstance(start, int) and start >= 0:
+            by_source.setdefault(doc.metadata.get("source"), []).append((rank, doc))
+        else:
+            passages.append((rank, doc))
+
+    merged = 0
+    for members in by_source.values():
+        members.sort(key=lambda member: member[1].metadata["start_index"])
+        rank, first = members[0]
+        text, start = first.page_content, first.metadata["start_index"]
+        for next_rank, doc in members[1:]:
+            next_start = doc.metadata["start_index"]
+            overlap = start + len(text) - next_start
+            if 0 <= overlap <= len(doc.page_content) and doc.page_content[:overlap] == text[len(text) - overlap:]:
+                text += doc.page_content[overlap:]
+                rank = min(rank, next_rank)
+                merged += 1
+                continue
+            passages.append((rank, _passage(first, text, start)))
+            rank, first = next_rank, doc
+            text, start = doc.page_content, next_start
+        passages.append((rank, _passage(first, text, start)))
+
+    passages.sort(key=lambda passage: passage[0])
+    return [doc for _, doc in passages], merged
+
+
+def _passage(first: Document, text: str, start: int) -> Document:
+    if text == first.page_content:
+        return first
+    return Document(id=first.id, page_content=text, metadata={**first.metadata, "start_index": start})
+
+
+def shingles(text: str, size: int = 3) -> set:
+    words = WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(docs: list, threshold: float) -> tuple:
+    """
+    Returns (docs, dropped_count), keeping the better ranked of each near-duplicate pair.
+    """
+    kept, kept_shingles = [], []
+    for doc in docs:
+        current = shingles(doc.page_content)
+        duplicate = any(
+            len(current & other) / max(1, min(len(current), len(other))) >= threshold
+            for other in kept_shingles
+        )
+        if not duplicate:
+            kept.append(doc)
+            kept_shingles.append(current)
+    return kept, len(docs) - len(kept)
+
+
+def truncate_to_tokens(text: str, tokens: int, budget: int) -> str:
+    """
+    Cuts text (of `tokens` tokens) to about `budget` tokens at a word boundary.
+    """
+    cut = text[:max(1, len(text) * budget // max(1, tokens))]
+    while cut and count_tokens(cut) > budget:
+        cut = cut[:int(len(cut) * 0.9)]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > 0 else cut).rstrip() + " ..."
+
+
+def fit_token_budget(docs: list, budget: int) -> tuple:
+    """
+    Returns (docs, truncated_count); docs keep their order.
+    """
+    fitted, remaining, truncated = [], budget, 0
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if tokens <= remaining:
+            fitted.append(doc)
+            remaining -= tokens
+        elif remaining >= MIN_PARTIAL_TOKENS:
+            text = truncate_to_tokens(doc.page_content, tokens, remaining)
+            fitted.append(Document(id=doc.id, page_content=text, metadata=doc.metadata))
+            truncated += 1
+            remaining = 0
+        if remaining < MIN_PARTIAL_TOKENS:
+            break
+    return fitted, truncated
+
+
+def pack_context(docs: list, token_budget: int, duplicate_threshold: float = 0.8) -> tuple:
+    """
+    Returns (packed_docs, report); token_budget <= 0 means no budget.
+    """
+    tokens_before = sum(count_tokens(doc.page_content) for doc in docs)
+    packed, merged = merge_overlapping(docs)
+    packed, duplicates = drop_near_duplicates(packed, duplicate_threshold)
+    truncated = 0
+    if token_budget > 0:
+        packed, truncated = fit_token_budget(packed, token_budget)
+    tokens_after = sum(count_tokens(doc.page_content) for doc in packed)
+    return packed, {
+        "chunks": len(docs),
+        "passages": len(packed),
+        "merged": merged,
+        "duplicates": duplicates,
+        "truncated": truncated,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+    }
+
+
+class ContextStats:
+    """
+    Totals of pack_context reports, plus rolling percentiles of tokens saved per request.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.saved = deque(maxlen=window)
+        self.totals = {"requests": 0, "merged": 0, "duplicates": 0, "truncated": 0, "tokens_before": 0, "tokens_after": 0}
+
+    def record(self, report: dict):
+        self.totals["requests"] += 1
+        for key in ("merged", "duplicates", "truncated", "tokens_before", "tokens_after"):
+            self.totals[key] += report[key]
+        self.saved.append(report["tokens_saved"])
+
+    def stats(self) -> dict:
+        totals = dict(self.totals)
+        saved = totals["tokens_before"] - totals["tokens_after"]
+        totals["tokens_saved"] = saved
+        totals["saved_fraction"] = round(saved / totals["tokens_before"], 3) if totals["tokens_before"] else 0.0
+        if self.saved:
+            values = np.fromiter(self.saved, dtype="float64")
+            totals["saved_per_request_p50"] = float(np.percentile(values, 50))
+            totals["saved_per_request_mean"] = round(float(values.mean()), 1)
+        return totals
@@ -4,17 +4,22 @@ from pathlib import Path
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from google_auth_httplib2 import AuthorizedHttp
+from drive_sync import DriveSyncEngine
 from dotenv import load_dotenv
-import io
+from functools import lru_cache
+import httplib2
 
 load_dotenv()
 
-CACHE_DIR = Path(__file__).resolve().parent / "data"
-CACHE_DIR.mkdir(exist_ok=True)
+CACHE_DIR = Path(os.environ.get("DATA_DIR") or Path(__file__).resolve().parent / "data")
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
 GOOGLE_DRIVE_FOLDER_ID = os.environ.get("GOOGLE_DRIVE_FOLDER_ID")
+DRIVE_SYNC_WORKERS = int(os.environ.get("DRIVE_SYNC_WORKERS", "4"))
 
 # Credentials
+@lru_cache(maxsize=None)
 def load_credentials_from_env():
     json_str = os.environ.get("GOOGLE_CREDENTIALS_JSON")
     if not json_str:
@@ -27,10 +32,27 @@ def load_credentials_from_env():
     )
     return creds
 
-# Connecting Google Drive to Credentials
+# Connecting Google Drive to Credentials (one client per process)
+@lru_cache(maxsize=None)
 def get_drive_service():
     creds = load_credentials_from_env()
-    return build("drive", "v3", credentials=creds)
+    return build("drive", "v3", credentials=creds, cache_discovery=False)
+
+
+def new_authorized_http():
+    # httplib2 is not thread-safe: each download thread gets its own connection
+    return AuthorizedHttp(load_credentials_from_env(), http=httplib2.Http())
+
+
+def get_sync_engine(folder_id: str, target_dir: Path, **kwargs) -> DriveSyncEngine:
+    return DriveSyncEngine(
+        get_drive_service(),
+        folder_id,
+        target_dir,
+        max_workers=DRIVE_SYNC_WORKERS,
+        http_factory=new_authorized_http,
+        **kwargs,
+    )
 
 # Listing files from shared folder
 def list_text_files(service):
@@ -40,25 +62,10 @@ def list_text_files(service):
     ).execute()
     return results.get("files", [])
 
-# Download files that are not local
+# Download files that are missing or changed on Drive
 def download_missing_files():
-    service = get_drive_service()
-    files = list_text_files(service)
-
-    for file in files:
-        local_path = CACHE_DIR / file["name"]
-        if local_path.exists():
-            print(f"[CACHE] Skipping {file['name']} (already exists)")
-            continue
-
-        print(f"[DOWNLOAD] Downloading {file['name']}...")
-        request = service.files().get_media(fileId=file["id"])
-        fh = io.FileIO(local_path, 'wb')
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        print(f"[SUCCESS] {file['name']} saved on {local_path}")
+    engine = get_sync_engine(GOOGLE_DRIVE_FOLDER_ID, CACHE_DIR, mime_type="text/plain")
+    return engine.sync()
 
 def get_local_txt_files():
     return [f for f in CACHE_DIR.glob("*.txt")]
@@ -89,7 +96,8 @@ def download_file_by_name(filename: str, output_path: Path):
 def download_faiss_index_from_drive(local_index_dir: Path):
     """
     Download FAISS index files (index.faiss and index.pkl) from Google Drive
-    Looks for them in a 'faiss_index' subfolder within the main folder
+    Looks for them in a 'faiss_index' subfolder within the main folder.
+    Files already present with the same checksum are not downloaded again.
     """
     service = get_drive_service()
     
@@ -107,16 +115,10 @@ def download_faiss_index_from_drive(local_index_dir: Path):
     faiss_folder_id = folders[0]['id']
     print(f"[DRIVE] Found faiss_index folder with ID: {faiss_folder_id}")
     
-    local_index_dir.mkdir(exist_ok=True, parents=True)
-    
-    index_faiss = local_index_dir / "index.faiss"
-    index_pkl = local_index_dir / "index.pkl"
-    
-    # Download from the subfolder
-    success_faiss = download_file_from_folder(faiss_folder_id, "index.faiss", index_faiss)
-    success_pkl = download_file_from_folder(faiss_folder_id, "index.pkl", index_pkl)
-    
-    if success_faiss and success_pkl:
+    engine = get_sync_engine(faiss_folder_id, local_index_dir, names={"index.faiss", "index.pkl"})
+    engine.sync()
+
+    if (local_index_dir / "index.faiss").exists() and (local_index_dir / "index.pkl").exists():
         print("[DRIVE] FAISS index downloaded successfully from Google Drive")
         return True
     else:
@@ -0,0 +1,250 @@
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from langchain_core.embeddings import Embeddings
+from langchain_openai.embeddings import OpenAIEmbeddings
+from dotenv import load_dotenv
+from singleflight import SingleFlight
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+load_dotenv()
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = Path(os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    str(Path(__file__).resolve().parent / "embedding_cache.sqlite3")
+))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with a two-level cache keyed by a hash of
+    (kind, model, text):
+
+    1) an in-process LRU of float32 vectors
+    2) a SQLite table on disk, bounded to max_disk_rows (least recently used
+       rows are pruned first)
+
+    Only texts missing from both levels are sent to the underlying model, so
+    repeated queries skip the network and rebuilding an index never re-embeds
+    a chunk whose text is unchanged. Concurrent async misses for the same
+    query share one request (see singleflight.py).
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, db_path, memory_items: int = 5000, max_disk_rows: int = 100000):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.db_path = str(db_path)
+        self.memory_items = memory_items
+        self.max_disk_rows = max_disk_rows
+
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        self._disk_rows = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._query_flights = SingleFlight("embedding")
+
+    # Keys and storage
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{kind}\0{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Reopen after a fork: SQLite connections must not cross processes
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            self._disk_rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _remember(self, items: dict):
+        with self._memory_lock:
+            for key, vector in items.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _get_from_memory(self, keys: list) -> dict:
+        found = {}
+        with self._memory_lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+        self.memory_hits += len(found)
+        return found
+
+    def _get_from_disk(self, keys: list) -> dict:
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+                if rows:
+                    conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+                        [time.time(), *batch],
+                    )
+            conn.commit()
+        self._remember(found)
+        self.disk_hits += len(found)
+        return found
+
+    def _put(self, items: dict):
+        self._remember(items)
+        with self._lock:
+            conn = self._connection()
+            now = time.time()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, vector.tobytes(), now) for key, vector in items.items()],
+            )
+            # Replaced keys do not add rows, so count rather than add len(items)
+            self._disk_rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._disk_rows > self.max_disk_rows:
+                # Prune down to 90% so we don't prune on every insert
+                excess = self._disk_rows - int(self.max_disk_rows * 0.9)
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._disk_rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            conn.commit()
+
+    # Lookup helpers shared by the sync and async paths
+
+    def _split(self, kind: str, texts: list):
+        keys = [self._key(kind, text) for text in texts]
+        found = self._get_from_memory(keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        return keys, found, missing
+
+    def _pending_texts(self, texts: list, keys: list, missing: set) -> dict:
+        # One entry per distinct text still needing an embedding
+        pending = {}
+        for text, key in zip(texts, keys):
+            if key in missing and key not in pending:
+                pending[key] = text
+        return pending
+
+    def _store_fresh(self, pending: dict, vectors: list) -> dict:
+        fresh = {key: np.asarray(vector, dtype="float32") for key, vector in zip(pending, vectors)}
+        self.misses += len(fresh)
+        if fresh:
+            self._put(fresh)
+        return fresh
+
+    # Embeddings interface
+
+    def embed_documents(self, texts: list) -> list:
+        keys, found, missing = self._split("doc", texts)
+        found.update(self._get_from_disk(missing))
+        pending = self._pending_texts(texts, keys, set(missing) - found.keys())
+        if pending:
+            vectors = self.underlying.embed_documents(list(pending.values()))
+            found.update(self._store_fresh(pending, vectors))
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list:
+        keys, found, missing = self._split("query", [text])
+        found.update(self._get_from_disk(missing))
+        if keys[0] not in found:
+            vector = self.underlying.embed_query(text)
+            found.update(self._store_fresh({keys[0]: text}, [vector]))
+        return found[keys[0]].tolist()
+
+    async def aembed_documents(self, texts: list) -> list:
+        keys, found, missing = self._split("doc", texts)
+        if missing:
+            found.update(await asyncio.to_thread(self._get_from_disk, missing))
+        pending = self._pending_texts(texts, keys, set(missing) - found.keys())
+        if pending:
+            vectors = await self.underlying.aembed_documents(list(pending.values()))
+            found.update(await asyncio.to_thread(self._store_fresh, pending, vectors))
+        return [found[key].tolist() for key in keys]
+
+    async def aembed_query(self, text: str) -> list:
+        keys, found, missing = self._split("query", [text])
+        if missing:
+            found.update(await asyncio.to_thread(self._get_from_disk, missing))
+        if keys[0] not in found:
+            found.update(await self._query_flights.run(keys[0], self._aembed_query_miss, keys[0], text))
+        return found[keys[0]].tolist()
+
+    async def aembed_queries(self, texts: list) -> list:
+        """
+        aembed_query for many texts, with the misses embedded in one request.
+        """
+        keys, found, missing = self._split("query", texts)
+        if missing:
+            found.update(await asyncio.to_thread(self._get_from_disk, missing))
+        pending = self._pending_texts(texts, keys, set(missing) - found.keys())
+        if pending:
+            vectors = await self.underlying.aembed_documents(list(pending.values()))
+            found.update(await asyncio.to_thread(self._store_fresh, pending, vectors))
+        return [found[key].tolist() for key in keys]
+
+    async def _aembed_query_miss(self, key: str, text: str) -> dict:
+        vector = await self.underlying.aembed_query(text)
+        return await asyncio.to_thread(self._store_fresh, {key: text}, [vector])
+
+    def stats(self) -> dict:
+        return {
+            "memory_items": len(self._memory),
+            "disk_rows": self._disk_rows,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self._query_flights.shared,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_embeddings():
+    """
+    Returns the shared embeddings model. Unless disabled, it is wrapped in an
+    in-memory + SQLite cache so repeated texts never hit the OpenAI API twice.
+    """
+    embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, chunk_size=100)
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+
+    return CachedEmbeddings(
+        embeddings,
+        model_name=EMBEDDING_MODEL,
+        db_path=EMBEDDING_CACHE_PATH,
+        memory_items=int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "5000")),
+        max_disk_rows=int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000")),
+    )
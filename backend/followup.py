@@ -0,0 +1,234 @@
+"""
+Follow-up question handling for the conversational retrieval chain.
+
+ConversationalRetrievalChain rewrites every follow-up into a standalone
+question with an extra LLM call before retrieval starts. FollowUpRetrievalChain
+makes that step configurable:
+
+    condense   rewrite with the LLM, then retrieve (the original behaviour)
+    skip       retrieve with the question as asked
+    local      retrieve with the question plus the user's last N turns, no LLM call
+    race       retrieve with the raw question while condensing; use the condensed
+               question if it arrives within race_timeout, else the raw results
+
+In every strategy the chat history is trimmed to a token budget, newest
+messages first, and the answering prompt receives it. The time from the
+start of the chain until documents are retrieved is recorded per strategy
+(see FollowUpStats); the answer call that follows is the same for all.
+
+Retrieved chunks are packed before they reach the prompt (see context.py).
+Callers that already retrieved the documents for a first-turn question (the
+batch endpoint, see batch.py) pass them as inputs[RETRIEVED_DOCUMENTS_KEY].
+"""
+from collections import deque
+from langchain_classic.chains.conversational_retrieval.base import ConversationalRetrievalChain, _get_chat_history
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain_core.messages import HumanMessage
+from pydantic import Field
+from context import ContextStats, pack_context
+from metrics import context_packed, stage
+from tokens import count_tokens
+from typing import Any
+import asyncio
+import time
+import numpy as np
+
+FOLLOWUP_STRATEGIES = ("condense", "skip", "local", "race")
+RETRIEVED_DOCUMENTS_KEY = "retrieved_documents"
+
+
+def trim_history(messages: list, token_budget: int) -> list:
+    """
+    Keeps the most recent messages whose combined size fits the token budget.
+    """
+    kept, used = [], 0
+    for message in reversed(messages):
+        tokens = count_tokens(message.content)
+        if used + tokens > token_budget:
+            break
+        kept.append(message)
+        used += tokens
+    return kept[::-1]
+
+
+def local_retrieval_query(question: str, messages: list, turns: int) -> str:
+    """
+    The question preceded by the user's last `turns` messages, so pronouns and
+    elliptical follow-ups still match the passages the conversation is about.
+    """
+    previous = [message.content for message in messages if isinstance(message, HumanMessage)]
+    return "\n".join(previous[-turns:] + [question]) if turns else question
+
+
+class FollowUpStats:
+    """
+    Rolling retrieval latency samples per strategy, in milliseconds, and
+    counts of which question the race strategy ended up using.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+        self.outcomes = {}
+
+    def record(self, strategy: str, seconds: float):
+        self.samples.setdefault(strategy, deque(maxlen=self.window)).append(seconds * 1000)
+        self.counts[strategy] = self.counts.get(strategy, 0) + 1
+
+    def outcome(self, name: str):
+        self.outcomes[name] = self.outcomes.get(name, 0) + 1
+
+    def stats(self) -> dict:
+        latency = {}
+        for strategy, samples in self.samples.items():
+            values = np.fromiter(samples, dtype="float64")
+            latency[strategy] = {
+                "count": self.counts[strategy],
+                "p50_ms": round(float(np.percentile(values, 50)), 1),
+                "p95_ms": round(float(np.percentile(values, 95)), 1),
+            }
+        return {"retrieval_latency": latency, "race_outcomes": dict(self.outcomes)}
+
+
+class FollowUpRetrievalChain(ConversationalRetrievalChain):
+    followup_strategy: str = "condense"
+    local_turns: int = 2
+    history_token_budget: int = 1500
+    race_timeout: float = 1.5
+    followup_stats: Any = Field(default_factory=FollowUpStats, exclude=True)
+    context_packing: bool = True
+    context_token_budget: int = 1200
+    duplicate_threshold: float = 0.8
+    context_stats: Any = Field(default_factory=ContextStats, exclude=True)
+
+    def _prepare(self, inputs: dict):
+        if self.followup_strategy not in FOLLOWUP_STRATEGIES:
+            raise ValueError(f"Unknown follow-up strategy '{self.followup_strategy}', expected one of {FOLLOWUP_STRATEGIES}")
+        messages = trim_history(inputs["chat_history"], self.history_token_budget)
+        return messages, _get_chat_history(messages)
+
+    def _pack(self, docs: list) -> list:
+        if not self.context_packing:
+            return docs
+        with stage("pack"):
+            packed, report = pack_context(docs, self.context_token_budget, self.duplicate_threshold)
+        self.context_stats.record(report)
+        context_packed(report["tokens_before"], report["tokens_after"])
+        return packed
+
+    def _get_docs(self, question: str, inputs: dict[str, Any], *, run_manager: CallbackManagerForChainRun) -> list:
+        docs = inputs.get(RETRIEVED_DOCUMENTS_KEY)
+        if docs is None:
+            docs = super()._get_docs(question, inputs, run_manager=run_manager)
+        return self._pack(docs)
+
+    async def _aretrieve(self, question: str, inputs: dict[str, Any], *, run_manager: AsyncCallbackManagerForChainRun) -> list:
+        docs = inputs.get(RETRIEVED_DOCUMENTS_KEY)
+        if docs is None:
+            docs = await super()._aget_docs(question, inputs, run_manager=run_manager)
+        return docs
+
+    async def _aget_docs(self, question: str, inputs: dict[str, Any], *, run_manager: AsyncCallbackManagerForChainRun) -> list:
+        return self._pack(await self._aretrieve(question, inputs, run_manager=run_manager))
+
+    def _answer_inputs(self, inputs: dict, question: str, chat_history_str: str) -> dict:
+        new_inputs = inputs.copy()
+        new_inputs.pop(RETRIEVED_DOCUMENTS_KEY, None)
+        if self.rephrase_question:
+            new_inputs["question"] = question
+        new_inputs["chat_history"] = chat_history_str
+        return new_inputs
+
+    def _output(self, answer: str, docs: list, question: str) -> dict:
+        output = {self.output_key: answer}
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = question
+        return output
+
+    # Chain.run/arun are deprecated: invoke the sub-chains and read their output key
+    def _condense(self, question: str, chat_history_str: str, run_manager) -> str:
+        result = self.question_generator.invoke(
+            {"question": question, "chat_history": chat_history_str},
+            config={"callbacks": run_manager.get_child()},
+        )
+        return result[self.question_generator.output_keys[0]]
+
+    async def _acondense(self, question: str, chat_history_str: str, run_manager) -> str:
+        result = await self.question_generator.ainvoke(
+            {"question": question, "chat_history": chat_history_str},
+            config={"callbacks": run_manager.get_child()},
+        )
+        return result[self.question_generator.output_keys[0]]
+
+    def _answer(self, docs: list, answer_inputs: dict, run_manager) -> str:
+        result = self.combine_docs_chain.invoke(
+            {"input_documents": docs, **answer_inputs},
+            config={"callbacks": run_manager.get_child()},
+        )
+        return result[self.combine_docs_chain.output_key]
+
+    async def _aanswer(self, docs: list, answer_inputs: dict, run_manager) -> str:
+        result = await self.combine_docs_chain.ainvoke(
+            {"input_documents": docs, **answer_inputs},
+            config={"callbacks": run_manager.get_child()},
+        )
+        return result[self.combine_docs_chain.output_key]
+
+    def _call(self, inputs: dict[str, Any], run_manager: CallbackManagerForChainRun | None = None) -> dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        started = time.perf_counter()
+        question = inputs["question"]
+        messages, chat_history_str = self._prepare(inputs)
+
+        # Without an event loop there is nothing to race against, so race condenses
+        strategy = self.followup_strategy if messages else "first_turn"
+        if strategy in ("condense", "race"):
+            question = self._condense(question, chat_history_str, _run_manager)
+        query = local_retrieval_query(question, messages, self.local_turns) if strategy == "local" else question
+        docs = self._get_docs(query, inputs, run_manager=_run_manager)
+        self.followup_stats.record(strategy, time.perf_counter() - started)
+
+        answer = self._answer(docs, self._answer_inputs(inputs, question, chat_history_str), _run_manager)
+        return self._output(answer, docs, question)
+
+    async def _race(self, question: str, chat_history_str: str, inputs: dict, run_manager) -> tuple:
+        # Only the winning retrieval is packed, so the losing one is not counted in the packing stats
+        raw_docs = asyncio.create_task(self._aretrieve(question, inputs, run_manager=run_manager))
+        condensing = asyncio.create_task(self._acondense(question, chat_history_str, run_manager))
+        try:
+            condensed = await asyncio.wait_for(condensing, timeout=self.race_timeout)
+        except asyncio.TimeoutError:
+            condensed = None
+        except Exception as e:
+            print(f"[FOLLOWUP] Condensing failed, using the raw question: {e}")
+            condensed = None
+
+        if condensed and condensed.strip().lower() != question.strip().lower():
+            raw_docs.cancel()
+            self.followup_stats.outcome("condensed")
+            return condensed, await self._aget_docs(condensed, inputs, run_manager=run_manager)
+
+        self.followup_stats.outcome("raw")
+        return question, self._pack(await raw_docs)
+
+    async def _acall(self, inputs: dict[str, Any], run_manager: AsyncCallbackManagerForChainRun | None = None) -> dict[str, Any]:
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        started = time.perf_counter()
+        question = inputs["question"]
+        messages, chat_history_str = self._prepare(inputs)
+
+        strategy = self.followup_strategy if messages else "first_turn"
+        if strategy == "race":
+            question, docs = await self._race(question, chat_history_str, inputs, _run_manager)
+        else:
+            if strategy == "condense":
+                question = await self._acondense(question, chat_history_str, _run_manager)
+            query = local_retrieval_query(question, messages, self.local_turns) if strategy == "local" else question
+            docs = await self._aget_docs(query, inputs, run_manager=_run_manager)
+        self.followup_stats.record(strategy, time.perf_counter() - started)
+
+        answer = await self._aanswer(docs, self._answer_inputs(inputs, question, chat_history_str), _run_manager)
+        return self._output(answer, docs, question)
@@ -0,0 +1,80 @@
+"""
+Gunicorn settings for running several workers on one node:
+
+    gunicorn main:app -c gunicorn.conf.py
+
+With PRELOAD_INDEX (the default), the app and the index are loaded once in
+the master process and the workers are forked from it. They share the
+index, the BM25 vocabulary and the language profiles read-only instead of
+each loading a copy:
+
+- the memory-mapped compact index files are shared through the page cache
+- everything else loaded before the fork (the FAISS index for types that
+  cannot be memory-mapped, Python objects) is shared copy-on-write; the
+  garbage collector is kept off during loading and the loaded objects are
+  frozen, so collections in the workers don't write to (and copy) their pages
+
+Use `python -m benchmarks.worker_memory` to compare per-worker memory with
+and without preloading.
+
+Each worker has its own Prometheus metrics. PROMETHEUS_MULTIPROC_DIR (by
+default a directory under the system temp dir, emptied at startup so a
+previous run's metrics are not added to this one's) is where
+they write them, so /metrics can add them up across workers (see
+metrics.py). It must be set before prometheus_client is imported, which is
+why it is set here.
+"""
+import gc
+import os
+import shutil
+import tempfile
+
+# Emptied here rather than in on_starting: with preload_app the app, and
+# prometheus_client, are imported before that hook runs
+METRICS_DIR = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "chatbot-prometheus"))
+shutil.rmtree(METRICS_DIR, ignore_errors=True)
+os.makedirs(METRICS_DIR)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("HISTORY_DRAIN_TIMEOUT", "30")) + 5
+
+PRELOAD_INDEX = os.getenv("PRELOAD_INDEX", "true").lower() == "true"
+preload_app = PRELOAD_INDEX
+
+# Each worker serves requests concurrently already; OpenMP threads inside
+# FAISS would only compete with the other workers, and are not fork-safe
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", "1"))
+
+
+def when_ready(server):
+    if not PRELOAD_INDEX:
+        return
+    import main
+    from prometheus_client import multiprocess
+
+    gc.disable()
+    if main.preload():
+        server.log.info("Index loaded in the master process, forking workers")
+    gc.freeze()
+    # The master serves no requests: drop its live gauges (the index version it loaded)
+    multiprocess.mark_process_dead(os.getpid())
+
+
+def post_fork(server, worker):
+    import faiss
+    faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+    gc.enable()
+
+    # Metric values start from zero in a forked worker
+    if PRELOAD_INDEX:
+        import main
+        if main.index_state.get("version"):
+            main.index_loaded(main.index_state["version"])
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
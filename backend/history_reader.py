@@ -0,0 +1,196 @@
+"""
+Reading chat_history without OFFSET scans.
+
+history_page returns one page of a session's turns for
+GET /sessions/{session_id}/history. Pages are keyset-paginated on
+(created_at, id): the cursor is the last row of the previous page, so each
+page is a range scan of ix_chat_history_session_id_created_at_id however
+deep it is, and turns written while a client pages through are neither
+skipped nor repeated.
+
+iter_history streams the whole table (or a created_at range of it) through a
+server-side cursor in (created_at, id) order, for the export command:
+
+    python history_reader.py history.jsonl [--since 2026-01-01] [--until 2026-02-01]
+    python history_reader.py history.parquet [--session-id abc] [--batch-size 5000]
+
+Rows are fetched and written batch_size at a time, so memory stays constant
+however large the table is. Parquet output requires pyarrow.
+"""
+from datetime import datetime, timezone
+from models import ChatHistory
+from sqlalchemy import select, tuple_
+from pathlib import Path
+import argparse
+import asyncio
+import base64
+import json
+import time
+
+EXPORT_FORMATS = ("jsonl", "parquet")
+COLUMNS = (ChatHistory.id, ChatHistory.session_id, ChatHistory.user_message, ChatHistory.bot_response, ChatHistory.created_at)
+
+
+def as_utc(value: datetime):
+    # SQLite returns naive datetimes; rows are always written in UTC
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([as_utc(created_at).isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Returns (created_at, id). Raises ValueError for a malformed cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return as_utc(datetime.fromisoformat(created_at)), int(row_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def row_dict(row) -> dict:
+    created_at = as_utc(row.created_at)
+    return {
+        "id": row.id,
+        "session_id": row.session_id,
+        "question": row.user_message,
+        "answer": row.bot_response,
+        "created_at": created_at.isoformat() if created_at is not None else None,
+    }
+
+
+async def history_page(session_factory, session_id: str, limit: int, cursor: str = None, newest_first: bool = True) -> dict:
+    """
+    One page of a session's turns, and the cursor of the next page (None on
+    the last one).
+    """
+    key = tuple_(ChatHistory.created_at, ChatHistory.id)
+    query = select(*COLUMNS).where(ChatHistory.session_id == session_id)
+    if cursor is not None:
+        after = decode_cursor(cursor)
+        query = query.where(key < after if newest_first else key > after)
+    if newest_first:
+        query = query.order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc())
+    else:
+        query = query.order_by(ChatHistory.created_at, ChatHistory.id)
+
+    # One extra row tells whether there is a next page
+    async with session_factory() as session:
+        rows = (await session.execute(query.limit(limit + 1))).all()
+    next_cursor = encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+    return {
+        "session_id": session_id,
+        "turns": [row_dict(row) for row in rows[:limit]],
+        "next_cursor": next_cursor,
+    }
+
+
+async def iter_history(engine, since: datetime = None, until: datetime = None, session_id: str = None, batch_size: int = 5000):
+    """
+    Yields lists of up to batch_size row dicts, oldest first, with
+    since <= created_at < until.
+    """
+    query = select(*COLUMNS).order_by(ChatHistory.created_at, ChatHistory.id)
+    if since is not None:
+        query = query.where(ChatHistory.created_at >= since)
+    if until is not None:
+        query = query.where(ChatHistory.created_at < until)
+    if session_id is not None:
+        query = query.where(ChatHistory.session_id == session_id)
+
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=batch_size))
+        async for rows in result.partitions(batch_size):
+            yield [row_dict(row) for row in rows]
+
+
+class JsonlWriter:
+    def __init__(self, path: Path):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows: list):
+        self.file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writes each batch as a row group.
+    """
+
+    def __init__(self, path: Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet export requires pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("id", pa.int64()),
+            ("session_id", pa.string()),
+            ("question", pa.string()),
+            ("answer", pa.string()),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+        ])
+        self.writer = pq.ParquetWriter(str(path), self.schema)
+
+    def write(self, rows: list):
+        columns = {name: [row[name] for row in rows] for name in self.schema.names}
+        columns["created_at"] = [datetime.fromisoformat(value) if value else None for value in columns["created_at"]]
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+async def export_history(path: Path, export_format: str, since: datetime = None, until: datetime = None, session_id: str = None, batch_size: int = 5000) -> int:
+    """
+    Streams chat_history into a JSONL or Parquet file. Returns the row count.
+    """
+    from db import engine
+
+    started = time.monotonic()
+    writer = ParquetWriter(path) if export_format == "parquet" else JsonlWriter(path)
+    count = 0
+    try:
+        async for rows in iter_history(engine, since, until, session_id, batch_size):
+            writer.write(rows)
+            count += len(rows)
+            print(f"[EXPORT] {count} rows written")
+    finally:
+        writer.close()
+        await engine.dispose()
+    print(f"[EXPORT] Exported {count} rows to {path} in {time.monotonic() - started:.1f}s")
+    return count
+
+
+def parse_time(value: str) -> datetime:
+    # Dates and naive times are taken as UTC
+    return as_utc(datetime.fromisoformat(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export chat_history to JSONL or Parquet.")
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, help="default: from the output file's extension")
+    parser.add_argument("--since", type=parse_time, help="first created_at to include (ISO date or time, UTC)")
+    parser.add_argument("--until", type=parse_time, help="created_at to stop before (ISO date or time, UTC)")
+    parser.add_argument("--session-id", help="export only this session")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows fetched and written at a time")
+    args = parser.parse_args()
+
+    export_format = args.format or ("parquet" if args.output.suffix == ".parquet" else "jsonl")
+    asyncio.run(export_history(args.output, export_format, args.since, args.until, args.session_id, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
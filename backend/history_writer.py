@@ -0,0 +1,173 @@
+"""
+Write-behind persistence for ChatHistory rows.
+
+Requests hand their row to ChatHistoryWriter.put() and return without waiting
+for the database. A background task collects rows into batches (up to
+batch_size rows, or whatever arrived within flush_interval seconds of the
+first one) and writes each batch with a single multi-row INSERT.
+
+- The queue is bounded: when it is full, put() waits up to enqueue_timeout
+  for space, then writes the row itself, so an overloaded or unavailable
+  database slows requests down instead of growing memory without limit.
+- Transient database errors are retried with exponential backoff.
+- stop() flushes everything still queued before the process exits.
+"""
+from collections import deque
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from models import ChatHistory
+import asyncio
+import time
+import numpy as np
+
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, ConnectionError, OSError, asyncio.TimeoutError)
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class ChatHistoryWriter:
+    def __init__(
+        self,
+        session_factory,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        enqueue_timeout: float = 1.0,
+        max_retries: int = 5,
+        retry_backoff: float = 0.5,
+    ):
+        self.session_factory = session_factory
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self.queue = None
+        self._task = None
+        self._closing = False
+        self._flush_ms = deque(maxlen=1000)
+        self.counters = {
+            "enqueued": 0,
+            "written": 0,
+            "batches": 0,
+            "retries": 0,
+            "failed_rows": 0,
+            "direct_writes": 0,
+        }
+
+    async def start(self):
+        # The queue binds to the running loop, so it is created here rather than in __init__
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, session_id: str, question: str, answer: str):
+        row = {
+            "session_id": session_id,
+            "user_message": question,
+            "bot_response": answer,
+            "created_at": datetime.now(timezone.utc),
+        }
+        if self._task is None or self._closing:
+            await self._write_direct(row)
+            return
+
+        try:
+            await asyncio.wait_for(self.queue.put(row), timeout=self.enqueue_timeout)
+            self.counters["enqueued"] += 1
+        except asyncio.TimeoutError:
+            print(f"[HISTORY] Queue full ({self.max_queue} rows), writing row directly")
+            await self._write_direct(row)
+
+    async def _write_direct(self, row: dict):
+        await self._insert([row])
+        self.counters["direct_writes"] += 1
+        self.counters["written"] += 1
+
+    async def _insert(self, rows: list):
+        async with self.session_factory() as session:
+            await session.execute(insert(ChatHistory), rows)
+            await session.commit()
+
+    async def _next_batch(self) -> list:
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._closing:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._insert(batch)
+                break
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_retries:
+                    self.counters["failed_rows"] += len(batch)
+                    print(f"[HISTORY] Dropping {len(batch)} chat history rows after {attempt + 1} attempts: {e}")
+                    return
+                self.counters["retries"] += 1
+                delay = self.retry_backoff * 2 ** attempt
+                print(f"[HISTORY] Transient database error, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+        self._flush_ms.append((time.perf_counter() - started) * 1000)
+        self.counters["written"] += len(batch)
+        self.counters["batches"] += 1
+
+    async def _run(self):
+        while not (self._closing and self.queue.empty()):
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+
+    async def stop(self, timeout: float = 30.0):
+        """
+        Stops accepting rows and waits for the queue to drain.
+        """
+        if self._task is None:
+            return
+        self._closing = True
+        pending = self.queue.qsize()
+        try:
+            await asyncio.wait_for(self._task, timeout=timeout)
+            print(f"[HISTORY] Drained {pending} queued chat history rows")
+        except asyncio.TimeoutError:
+            lost = self.queue.qsize()
+            self.counters["failed_rows"] += lost
+            print(f"[HISTORY] Drain timed out, {lost} chat history rows were not written")
+        self._task = None
+
+    def stats(self) -> dict:
+        flush_ms = np.fromiter(self._flush_ms, dtype="float64")
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue": self.max_queue,
+            **self.counters,
+            "flush_p50_ms": round(float(np.percentile(flush_ms, 50)), 1) if len(flush_ms) else None,
+            "flush_p95_ms": round(float(np.percentile(flush_ms, 95)), 1) if len(flush_ms) else None,
+        }
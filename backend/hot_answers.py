@@ -0,0 +1,275 @@
+"""
+Precomputed answers for the most frequent first-turn questions.
+
+The offline job reads the first question of every session in chat_history
+and groups the questions per language by normalized text (see
+normalize_question). Within a language, variants whose embeddings are
+close (cosine >= threshold) are merged into clusters. For the top clusters,
+the job retrieves context for the canonical question (the most frequent
+wording of the cluster) and answers it with the serving chain, as batch.py
+does:
+
+    python hot_answers.py [--top 50] [--since 2026-01-01] [--output hot_answers.json]
+
+The artifact records, for each cluster, the answer, the retrieved context
+and every normalized variant seen. It also records the share of historical
+first turns the clusters cover. Each run writes a new version, atomically.
+
+The server loads the artifact at startup (HOT_ANSWERS_PATH). A first-turn
+question whose (language, normalized text) is one of the variants is
+answered from a dict lookup, before the semantic cache and without calling
+any model. HotAnswers.stats() reports the artifact's coverage and the live
+hit rate.
+"""
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+import numpy as np
+
+HOT_ANSWERS_PATH = Path(os.getenv("HOT_ANSWERS_PATH", "hot_answers.json"))
+ARTIFACT_FORMAT = 1
+
+
+def normalize_question(question: str) -> str:
+    """
+    Casefolded, whitespace collapsed, surrounding punctuation stripped.
+    """
+    return re.sub(r"\s+", " ", question.casefold()).strip(" .!?¿¡,;:\"'")
+
+
+class HotAnswers:
+    """
+    Lookup table from (language, normalized question) to a precomputed answer.
+    """
+
+    def __init__(self, artifact: dict):
+        self.version = artifact["version"]
+        self.index_version = artifact.get("index_version")
+        self.coverage = artifact.get("coverage", {})
+        self.entries = artifact["entries"]
+        self._answers = {
+            (entry["language"], variant): entry["answer"]
+            for entry in self.entries
+            for variant in entry["variants"]
+        }
+        self.lookups = 0
+        self.hits = 0
+
+    @classmethod
+    def load(cls, path: Path = HOT_ANSWERS_PATH):
+        """
+        Returns None if there is no artifact at path.
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            artifact = json.load(f)
+        if artifact.get("format") != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported hot answers format {artifact.get('format')} in {path}")
+        return cls(artifact)
+
+    def lookup(self, question: str, language: str):
+        self.lookups += 1
+        answer = self._answers.get((language, normalize_question(question)))
+        if answer is not None:
+            self.hits += 1
+        return answer
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "index_version": self.index_version,
+            "questions": len(self.entries),
+            "variants": len(self._answers),
+            "coverage": self.coverage.get("all", 0.0),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+
+# Offline job
+
+async def count_first_turns(engine, since: datetime = None, until: datetime = None, batch_size: int = 5000) -> Counter:
+    """
+    Counts the first question of each session, as asked, streaming the rows
+    through a server-side cursor.
+    """
+    from models import ChatHistory
+    from sqlalchemy import func, select
+
+    turn = func.row_number().over(
+        partition_by=ChatHistory.session_id,
+        order_by=(ChatHistory.created_at, ChatHistory.id),
+    )
+    turns = select(ChatHistory.user_message, ChatHistory.created_at, turn.label("turn")).subquery()
+    query = select(turns.c.user_message).where(turns.c.turn == 1)
+    if since is not None:
+        query = query.where(turns.c.created_at >= since)
+    if until is not None:
+        query = query.where(turns.c.created_at < until)
+
+    counts = Counter()
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=batch_size))
+        async for rows in result.partitions(batch_size):
+            counts.update(row.user_message for row in rows if row.user_message)
+    return counts
+
+
+def group_variants(counts: Counter, detector) -> dict:
+    """
+    {language: {normalized: (count, wordings Counter)}}.
+    """
+    from language import DEFAULT_LANGUAGE
+
+    variants = {}
+    for question, count in counts.items():
+        normalized = normalize_question(question)
+        if not normalized:
+            continue
+        variants.setdefault(normalized, [0, Counter()])
+        variants[normalized][0] += count
+        variants[normalized][1][question] += count
+
+    by_language = {}
+    for normalized, (count, wordings) in variants.items():
+        language, confidence, _ = detector.detect(wordings.most_common(1)[0][0])
+        if language is None or confidence < detector.min_confidence:
+            language = DEFAULT_LANGUAGE
+        by_language.setdefault(language, {})[normalized] = (count, wordings)
+    return by_language
+
+
+def cluster_variants(variants: dict, vectors: np.ndarray, threshold: float) -> list:
+    """
+    Greedy clustering, most frequent variant first: a variant joins the first
+    cluster whose leader it is at least `threshold` similar to, else starts
+    one. variants maps normalized text to (count, wordings), in the order of
+    vectors. Returns clusters sorted by total count.
+    """
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    names = list(variants)
+    order = sorted(range(len(names)), key=lambda i: variants[names[i]][0], reverse=True)
+
+    clusters, leaders = [], []
+    for i in order:
+        if leaders:
+            scores = np.stack(leaders) @ vectors[i]
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                clusters[best].append(names[i])
+                continue
+        clusters.append([names[i]])
+        leaders.append(vectors[i])
+
+    result = []
+    for members in clusters:
+        wordings = Counter()
+        for name in members:
+            wordings.update(variants[name][1])
+        result.append({
+            "question": wordings.most_common(1)[0][0],
+            "count": sum(variants[name][0] for name in members),
+            "variants": members,
+        })
+    return sorted(result, key=lambda cluster: cluster["count"], reverse=True)
+
+
+async def build_hot_answers(args) -> dict:
+    # The same chain, prompt and models as the server
+    import main as app
+    from batch import answer_batch
+    from db import engine
+    from embedding_cache import get_embeddings
+    from index_builder import write_json_atomic
+    from retriever import build_retriever
+
+    started = time.monotonic()
+    counts = await count_first_turns(engine, args.since, args.until)
+    total = sum(counts.values())
+    print(f"[HOT] {total} first-turn questions, {len(counts)} distinct wordings")
+
+    await asyncio.to_thread(app.language_detector.load)
+    by_language = await asyncio.to_thread(group_variants, counts, app.language_detector)
+
+    embeddings = get_embeddings()
+    selected = []
+    for language, variants in sorted(by_language.items()):
+        # Only the most frequent variants can form a top cluster; don't embed the long tail
+        candidates = dict(sorted(variants.items(), key=lambda item: item[1][0], reverse=True)[:args.top * args.candidates])
+        vectors = np.asarray(await embeddings.aembed_documents(list(candidates)), dtype="float32")
+        clusters = cluster_variants(candidates, vectors, args.threshold)
+        clusters = [cluster for cluster in clusters if cluster["count"] >= args.min_count][:args.top]
+        for cluster in clusters:
+            cluster["language"] = language
+        selected.extend(clusters)
+        print(f"[HOT] {language}: {len(variants)} variants, {len(clusters)} clusters selected")
+
+    retriever = await asyncio.to_thread(build_retriever)
+    chain = app.build_chain(retriever)
+    inputs = [app.build_chain_inputs(cluster["question"], [], cluster["language"]) for cluster in selected]
+    entries = []
+    async for position, result, docs in answer_batch(chain, retriever, inputs, args.concurrency):
+        cluster = selected[position]
+        if isinstance(result, Exception):
+            print(f"[HOT] Skipping {cluster['question']!r}: {result}")
+            continue
+        entries.append({
+            **cluster,
+            "answer": result["answer"],
+            "context": [
+                {"id": doc.id, "source": doc.metadata.get("source"), "start_index": doc.metadata.get("start_index"), "text": doc.page_content}
+                for doc in docs
+            ],
+        })
+    entries.sort(key=lambda entry: entry["count"], reverse=True)
+
+    coverage = {"all": round(sum(entry["count"] for entry in entries) / total, 4) if total else 0.0}
+    for language, variants in by_language.items():
+        language_total = sum(count for count, _ in variants.values())
+        covered = sum(entry["count"] for entry in entries if entry["language"] == language)
+        coverage[language] = round(covered / language_total, 4) if language_total else 0.0
+
+    artifact = {
+        "format": ARTIFACT_FORMAT,
+        "version": datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ"),
+        "index_version": retriever.version,
+        "settings": {"top": args.top, "threshold": args.threshold, "min_count": args.min_count},
+        "first_turns": total,
+        "coverage": coverage,
+        "entries": entries,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(args.output, artifact)
+    await engine.dispose()
+    print(f"[HOT] Wrote {len(entries)} answers to {args.output} (version {artifact['version']}), "
+          f"covering {coverage['all']:.1%} of first turns, in {time.monotonic() - started:.1f}s")
+    return artifact
+
+
+def main():
+    from history_reader import parse_time
+
+    parser = argparse.ArgumentParser(description="Precompute answers for the most frequent first-turn questions.")
+    parser.add_argument("--output", type=Path, default=HOT_ANSWERS_PATH)
+    parser.add_argument("--top", type=int, default=50, help="questions per language")
+    parser.add_argument("--threshold", type=float, default=0.9, help="cosine similarity for two wordings to be one question")
+    parser.add_argument("--min-count", type=int, default=3, help="times a question (all its wordings) must have been asked")
+    parser.add_argument("--candidates", type=int, default=20, help="variants embedded per selected question")
+    parser.add_argument("--concurrency", type=int, default=8, help="answers generated at once")
+    parser.add_argument("--since", type=parse_time, help="first created_at to include (ISO date or time, UTC)")
+    parser.add_argument("--until", type=parse_time, help="created_at to stop before (ISO date or time, UTC)")
+    args = parser.parse_args()
+    asyncio.run(build_hot_answers(args))
+
+
+if __name__ == "__main__":
+    main()
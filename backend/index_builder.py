@@ -0,0 +1,450 @@
+"""
+Incremental FAISS index builder.
+
+Keeps a manifest (manifest.json) next to the index with the content hash and
+chunk IDs of every indexed file. On each run only new or changed files are
+chunked and embedded, and vectors of removed or changed files are dropped.
+Files are split in a process pool and embedded in batches as they are split
+(see loader.py); batches run concurrently under a requests-per-minute limit.
+A chunk whose text is already in the index is not added again; the file
+records the ID of the indexed copy in its shared_ids instead. When the file
+owning that copy is removed or changed, the files sharing it are chunked
+again, so they never lose a chunk (the embedding cache serves the vectors).
+
+Progress is checkpointed every few thousand chunks, so a crashed build picks
+up where it left off (and the embedding cache makes any repeated work free).
+
+The server loads the compact, memory-mapped copy written at the end of each
+build (see compact_index.py). Its index type is taken from FAISS_INDEX_TYPE
+and related settings (see index_types.py); changing them only re-exports,
+never re-embeds. With INDEX_SHARDS (the default) the copy is split into one
+compact index per source file (see sharded_index.py), and only the shards of
+new or changed files are exported again.
+
+Each export is a new version, <index-dir>/versions/<version>, and
+<index-dir>/current.json names the one to serve. The pointer is replaced
+atomically once the version is complete, so a server reloading the index
+(see main.py) never sees a half-written one. The newest INDEX_KEEP_VERSIONS
+versions are kept; older ones are deleted. Indexes written before
+versioning live in <index-dir>/compact and are served until the next export.
+
+Usage:
+    python index_builder.py [--index-dir faiss_index] [--data-dir data] [--full] [--chunk-workers N]
+"""
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from embedding_cache import EMBEDDING_MODEL, get_embeddings
+from loader import CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_WORKERS, file_sha256, iter_chunk_batches, text_key
+from drive_loader import CACHE_DIR
+from compact_index import compact_index_spec, export_compact, is_compact_index
+from sharded_index import export_sharded, is_sharded_index, sharded_index_spec
+from index_types import IndexSpec
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import shutil
+import time
+import faiss
+
+INDEX_DIR = Path("faiss_index")
+# Unversioned compact index written by earlier builds
+COMPACT_DIRNAME = "compact"
+VERSIONS_DIRNAME = "versions"
+CURRENT_NAME = "current.json"
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+INDEX_SHARDS = os.getenv("INDEX_SHARDS", "true").lower() == "true"
+MANIFEST_NAME = "manifest.json"
+# 2: duplicate chunks are dropped
+# 3: chunks a file shares with another file are recorded in its shared_ids
+MANIFEST_VERSION = 3
+
+
+def index_settings() -> dict:
+    # Any change here invalidates every stored vector
+    return {
+        "version": MANIFEST_VERSION,
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+    }
+
+
+def load_manifest(index_dir: Path) -> dict:
+    path = index_dir / MANIFEST_NAME
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"settings": index_settings(), "files": {}}
+
+
+def write_json_atomic(path: Path, data: dict):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_index_version(path: Path) -> bool:
+    return is_compact_index(path) or is_sharded_index(path)
+
+
+def needs_export(serving_dir, spec: IndexSpec) -> bool:
+    """
+    True unless serving_dir is an index of the configured spec and layout.
+    """
+    if serving_dir is None:
+        return True
+    if is_sharded_index(serving_dir):
+        return not INDEX_SHARDS or sharded_index_spec(serving_dir) != spec
+    return INDEX_SHARDS or compact_index_spec(serving_dir) != spec
+
+
+def current_version(index_dir: Path = INDEX_DIR):
+    """
+    The version named by current.json, or None if there is none.
+    """
+    path = Path(index_dir) / CURRENT_NAME
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["version"]
+
+
+def current_compact_dir(index_dir: Path = INDEX_DIR):
+    """
+    The index to serve, compact or sharded: the current version, else an
+    unversioned one, else None.
+    """
+    index_dir = Path(index_dir)
+    version = current_version(index_dir)
+    if version is not None and is_index_version(index_dir / VERSIONS_DIRNAME / version):
+        return index_dir / VERSIONS_DIRNAME / version
+    if is_compact_index(index_dir / COMPACT_DIRNAME):
+        return index_dir / COMPACT_DIRNAME
+    return None
+
+
+def list_versions(index_dir: Path = INDEX_DIR) -> list:
+    """
+    Complete versions, oldest first. Names sort by creation time.
+    """
+    versions_dir = Path(index_dir) / VERSIONS_DIRNAME
+    if not versions_dir.exists():
+        return []
+    # Skips the exporters' .tmp/.old working directories
+    return sorted(
+        path.name for path in versions_dir.iterdir()
+        if path.is_dir() and "." not in path.name and is_index_version(path)
+    )
+
+
+def prune_versions(index_dir: Path = INDEX_DIR, keep: int = INDEX_KEEP_VERSIONS, protect=()) -> list:
+    """
+    Deletes all but the newest `keep` versions, never the current one or any
+    in protect. Servers still mapping a deleted version's files keep reading
+    them until they let go (POSIX unlink semantics). Returns the deleted names.
+    """
+    index_dir = Path(index_dir)
+    protected = {current_version(index_dir), *protect}
+    versions = list_versions(index_dir)
+    deleted = [version for version in versions[:max(0, len(versions) - keep)] if version not in protected]
+    for version in deleted:
+        shutil.rmtree(index_dir / VERSIONS_DIRNAME / version, ignore_errors=True)
+    if deleted:
+        print(f"[INDEX] Deleted old index versions: {', '.join(deleted)}")
+    return deleted
+
+
+def publish_compact(store: FAISS, index_dir: Path, spec: IndexSpec) -> Path:
+    """
+    Exports the store as a new version, sharded per source if INDEX_SHARDS,
+    and makes it current.
+    """
+    index_dir = Path(index_dir)
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    if INDEX_SHARDS:
+        version_dir = export_sharded(store, index_dir / VERSIONS_DIRNAME / version, spec, current_compact_dir(index_dir))
+    else:
+        version_dir = export_compact(store, index_dir / VERSIONS_DIRNAME / version, spec)
+    write_json_atomic(index_dir / CURRENT_NAME, {"version": version, "published_at": time.time()})
+    print(f"[INDEX] Index version {version} is current")
+
+    # Superseded by the first versioned export
+    shutil.rmtree(index_dir / COMPACT_DIRNAME, ignore_errors=True)
+    prune_versions(index_dir)
+    return version_dir
+
+
+def save_checkpoint(store: FAISS, manifest: dict, index_dir: Path):
+    """
+    Saves the index next to its final location, then swaps it in and writes
+    the manifest last, so the manifest never lists chunks the index lacks.
+    """
+    index_dir.mkdir(parents=True, exist_ok=True)
+    tmp_dir = index_dir / ".checkpoint"
+    store.save_local(str(tmp_dir))
+    for name in ("index.faiss", "index.pkl"):
+        os.replace(tmp_dir / name, index_dir / name)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    manifest["updated_at"] = time.time()
+    write_json_atomic(index_dir / MANIFEST_NAME, manifest)
+    print(f"[INDEX] Checkpoint saved ({store.index.ntotal} vectors)")
+
+
+def load_existing_store(index_dir: Path, manifest: dict, embeddings):
+    """
+    Loads the previous index and reconciles it with the manifest after a crash.
+    Returns (store, manifest); store is None when a full rebuild is required.
+    """
+    if manifest.get("settings") != index_settings():
+        print("[INDEX] Index settings changed, rebuilding from scratch")
+        return None, {"settings": index_settings(), "files": {}}
+
+    if not (index_dir / "index.faiss").exists() or not (index_dir / "index.pkl").exists():
+        return None, {"settings": index_settings(), "files": {}}
+
+    store = FAISS.load_local(str(index_dir), embeddings, allow_dangerous_deserialization=True)
+    if store.index.ntotal != len(store.index_to_docstore_id):
+        print("[INDEX] Index and docstore are out of sync, rebuilding from scratch")
+        return None, {"settings": index_settings(), "files": {}}
+
+    files = manifest["files"]
+    stored_ids = set(store.index_to_docstore_id.values())
+    known_ids = {chunk_id for entry in files.values() for chunk_id in entry["chunk_ids"]}
+
+    # Vectors written by a checkpoint whose manifest never made it to disk
+    orphans = stored_ids - known_ids
+    if orphans:
+        print(f"[INDEX] Dropping {len(orphans)} vectors not listed in the manifest")
+        store.delete(list(orphans))
+
+    # Files the manifest lists but whose vectors are incomplete get re-embedded
+    for name, entry in list(files.items()):
+        if not stored_ids.issuperset(entry["chunk_ids"]):
+            present = [chunk_id for chunk_id in entry["chunk_ids"] if chunk_id in stored_ids]
+            if present:
+                store.delete(present)
+            del files[name]
+
+    return store, manifest
+
+
+class RateLimiter:
+    """
+    Spaces out request starts so at most `per_minute` begin in any minute.
+    """
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / per_minute
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def indexed_text_ids(store: FAISS, files: dict) -> dict:
+    """
+    {text_key(): chunk ID} of the chunks already in the index, so the chunker
+    drops new copies of them and records the IDs as shared.
+    """
+    return {
+        text_key(store.docstore.search(chunk_id).page_content): chunk_id
+        for entry in files.values()
+        for chunk_id in entry["chunk_ids"]
+    }
+
+
+def dependent_files(files: dict, dropped: set) -> list:
+    """
+    Names of the files not in dropped that share a chunk no kept file owns
+    any more, directly or through another such file.
+    """
+    dropped, dependents = set(dropped), []
+    while True:
+        kept_ids = {chunk_id for name, entry in files.items() if name not in dropped for chunk_id in entry["chunk_ids"]}
+        found = [
+            name for name, entry in files.items()
+            if name not in dropped and not set(entry.get("shared_ids", [])) <= kept_ids
+        ]
+        if not found:
+            return dependents
+        dependents += found
+        dropped.update(found)
+
+
+async def build_index(
+    index_dir: Path = INDEX_DIR,
+    data_dir: Path = CACHE_DIR,
+    embeddings=None,
+    full: bool = False,
+    concurrency: int = 4,
+    requests_per_minute: int = 500,
+    batch_size: int = 100,
+    checkpoint_every: int = 5000,
+    chunk_workers: int = CHUNK_WORKERS,
+):
+    """
+    Brings the index in index_dir up to date with the .txt files in data_dir.
+    Returns the FAISS vector store, or None if there is nothing to index.
+    """
+    index_dir = Path(index_dir)
+    embeddings = embeddings or get_embeddings()
+    spec = IndexSpec.from_env()
+    started = time.monotonic()
+
+    manifest = load_manifest(index_dir)
+    if full:
+        store, manifest = None, {"settings": index_settings(), "files": {}}
+    else:
+        store, manifest = await asyncio.to_thread(load_existing_store, index_dir, manifest, embeddings)
+    files = manifest["files"]
+
+    paths = {path.name: path for path in sorted(Path(data_dir).glob("*.txt"))}
+    hashes = {name: await asyncio.to_thread(file_sha256, path) for name, path in paths.items()}
+
+    removed = [name for name in files if name not in paths]
+    changed = [name for name in paths if files.get(name, {}).get("sha256") != hashes[name]]
+    # Files sharing chunks of those are chunked again to store their own copy
+    dependents = dependent_files(files, set(removed + changed))
+    changed += dependents
+
+    stale_ids = [chunk_id for name in removed + changed if name in files for chunk_id in files[name]["chunk_ids"]]
+    if stale_ids:
+        store.delete(stale_ids)
+    for name in removed + changed:
+        files.pop(name, None)
+
+    print(f"[INDEX] {len(paths)} files: {len(changed) - len(dependents)} new or changed, {len(removed)} removed, "
+          f"{len(dependents)} sharing their chunks")
+    if not changed:
+        if removed:
+            save_checkpoint(store, manifest, index_dir)
+        serving_dir = current_compact_dir(index_dir)
+        if store is not None and (removed or needs_export(serving_dir, spec)):
+            await asyncio.to_thread(publish_compact, store, index_dir, spec)
+        return store
+
+    seen = await asyncio.to_thread(indexed_text_ids, store, files) if store is not None else {}
+    batches = iter_chunk_batches([(paths[name], hashes[name]) for name in changed], batch_size, chunk_workers, seen)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(requests_per_minute)
+
+    async def embed_batch(chunks: list):
+        async with semaphore:
+            await limiter.wait()
+            return chunks, await embeddings.aembed_documents([chunk.page_content for chunk in chunks])
+
+    def add_batch(chunks: list, vectors: list):
+        nonlocal store
+        if store is None:
+            store = FAISS(
+                embedding_function=embeddings,
+                index=faiss.IndexFlatL2(len(vectors[0])),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+            )
+        store.add_embeddings(
+            list(zip([chunk.page_content for chunk in chunks], vectors)),
+            metadatas=[chunk.metadata for chunk in chunks],
+            ids=[chunk.id for chunk in chunks],
+        )
+        for chunk in chunks:
+            unembedded[chunk.metadata["source"]] -= 1
+
+    def record_finished_files():
+        # A file enters the manifest once it is fully split and all its chunks are stored
+        for name in [name for name in split_files if not unembedded.get(name)]:
+            ids, shared_ids = split_files.pop(name)
+            files[name] = {"sha256": hashes[name], "chunk_ids": ids, "shared_ids": shared_ids}
+            print(f"[INDEX] Embedded {name} ({len(ids)} chunks, {len(shared_ids)} shared)")
+
+    unembedded, split_files = {}, {}
+    tasks, exhausted, since_checkpoint = set(), False, 0
+    try:
+        while tasks or not exhausted:
+            # Keep the embedder busy with one batch waiting per request in flight
+            while not exhausted and len(tasks) < 2 * concurrency:
+                item = await asyncio.to_thread(next, batches, None)
+                if item is None:
+                    exhausted = True
+                    break
+                chunks, finished = item
+                for chunk in chunks:
+                    unembedded[chunk.metadata["source"]] = unembedded.get(chunk.metadata["source"], 0) + 1
+                split_files.update((path.name, (ids, shared_ids)) for path, ids, shared_ids in finished)
+                if chunks:
+                    tasks.add(asyncio.create_task(embed_batch(chunks)))
+
+            if tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    chunks, vectors = task.result()
+                    add_batch(chunks, vectors)
+                    since_checkpoint += len(chunks)
+            record_finished_files()
+
+            if since_checkpoint >= checkpoint_every:
+                await asyncio.to_thread(save_checkpoint, store, manifest, index_dir)
+                since_checkpoint = 0
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        if store is not None:
+            save_checkpoint(store, manifest, index_dir)
+            print("[INDEX] Build interrupted; progress saved, re-run to resume")
+        raise
+    finally:
+        # Fails if a worker thread is still inside the generator; the pool is then shut down at exit
+        with contextlib.suppress(ValueError):
+            batches.close()
+
+    if store is not None:
+        await asyncio.to_thread(save_checkpoint, store, manifest, index_dir)
+        await asyncio.to_thread(publish_compact, store, index_dir, spec)
+    print(f"[INDEX] Build finished in {time.monotonic() - started:.1f}s")
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the FAISS index incrementally.")
+    parser.add_argument("--index-dir", type=Path, default=INDEX_DIR)
+    parser.add_argument("--data-dir", type=Path, default=CACHE_DIR)
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and re-index every file")
+    parser.add_argument("--concurrency", type=int, default=4, help="embedding requests in flight")
+    parser.add_argument("--rpm", type=int, default=500, help="max embedding requests per minute")
+    parser.add_argument("--batch-size", type=int, default=100, help="chunks per embedding request")
+    parser.add_argument("--checkpoint-every", type=int, default=5000, help="chunks between checkpoints")
+    parser.add_argument("--chunk-workers", type=int, default=CHUNK_WORKERS, help="processes splitting files")
+    parser.add_argument("--upload", action="store_true", help="upload the index to Google Drive afterwards")
+    args = parser.parse_args()
+
+    asyncio.run(build_index(
+        index_dir=args.index_dir,
+        data_dir=args.data_dir,
+        full=args.full,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        batch_size=args.batch_size,
+        checkpoint_every=args.checkpoint_every,
+        chunk_workers=args.chunk_workers,
+    ))
+
+    if args.upload:
+        from drive_loader import upload_faiss_index_to_drive
+        upload_faiss_index_to_drive(args.index_dir)
+
+
+if __name__ == "__main__":
+    main()
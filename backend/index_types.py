@@ -0,0 +1,159 @@
+"""
+Serving index types for the compact index.
+
+The index builder always keeps an exact flat index of full-dimension vectors
+(the source of truth). The index served to chats is derived from it and can be:
+
+    flat       exact search (default)
+    ivf_flat   inverted lists, exact distances within the probed lists
+    ivf_pq     inverted lists with product-quantized vectors
+    hnsw       graph-based search
+
+optionally on reduced-dimension vectors (text-embedding-3 vectors may be
+truncated and re-normalized) and/or float16 storage. The chosen spec is
+recorded in the compact index's meta.json, and query embeddings are
+truncated to match at load time.
+
+Use `python -m benchmarks.index_search` to compare recall@4, latency and memory.
+"""
+from dataclasses import asdict, dataclass
+from langchain_core.embeddings import Embeddings
+import math
+import os
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+@dataclass
+class IndexSpec:
+    index_type: str = "flat"
+    dimensions: int = 0  # 0 keeps the full embedding dimension
+    float16: bool = False
+    nlist: int = 0  # 0 picks about 4 * sqrt(n) lists
+    nprobe: int = 16
+    pq_m: int = 0  # 0 picks dimension / 16 sub-quantizers
+    hnsw_m: int = 32
+    ef_search: int = 64
+
+    def __post_init__(self):
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{self.index_type}', expected one of {INDEX_TYPES}")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            index_type=os.getenv("FAISS_INDEX_TYPE", "flat"),
+            dimensions=int(os.getenv("FAISS_INDEX_DIMENSIONS", "0")),
+            float16=os.getenv("FAISS_INDEX_FLOAT16", "false").lower() == "true",
+            nlist=int(os.getenv("FAISS_IVF_NLIST", "0")),
+            nprobe=int(os.getenv("FAISS_IVF_NPROBE", "16")),
+            pq_m=int(os.getenv("FAISS_PQ_M", "0")),
+            hnsw_m=int(os.getenv("FAISS_HNSW_M", "32")),
+            ef_search=int(os.getenv("FAISS_HNSW_EF_SEARCH", "64")),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def label(self) -> str:
+        parts = [self.index_type]
+        if self.dimensions:
+            parts.append(f"d{self.dimensions}")
+        if self.float16 and self.index_type != "ivf_pq":
+            parts.append("fp16")
+        return "/".join(parts)
+
+
+def reduce_dimensions(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """
+    Truncates vectors to the first `dimensions` components and re-normalizes them.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    if not dimensions or dimensions >= vectors.shape[1]:
+        return vectors
+    reduced = np.ascontiguousarray(vectors[:, :dimensions])
+    faiss.normalize_L2(reduced)
+    return reduced
+
+
+def factory_string(spec: IndexSpec, dimension: int, count: int) -> str:
+    storage = "SQfp16" if spec.float16 else "Flat"
+
+    if spec.index_type == "flat":
+        return storage
+    if spec.index_type == "hnsw":
+        return f"HNSW{spec.hnsw_m}" + (",SQfp16" if spec.float16 else "")
+
+    # IVF needs roughly 39 training points per list
+    nlist = spec.nlist or int(4 * math.sqrt(count))
+    nlist = max(1, min(nlist, count // 39 or 1))
+
+    if spec.index_type == "ivf_flat":
+        return f"IVF{nlist},{storage}"
+
+    pq_m = spec.pq_m or max(1, dimension // 16)
+    while dimension % pq_m:
+        pq_m -= 1
+    # Each sub-quantizer also needs ~39 points per centroid; small corpora get smaller codes
+    pq_bits = max(1, min(8, int(math.log2(max(count // 39, 2)))))
+    return f"IVF{nlist},PQ{pq_m}x{pq_bits}"
+
+
+def build_serving_index(vectors: np.ndarray, spec: IndexSpec):
+    """
+    Builds (and trains, if needed) an index of the given spec over full-dimension vectors.
+    Returns (index, factory string).
+    """
+    vectors = reduce_dimensions(vectors, spec.dimensions)
+    count, dimension = vectors.shape
+    factory = factory_string(spec, dimension, count)
+
+    index = faiss.index_factory(dimension, factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    configure_search(index, spec)
+    return index, factory
+
+
+def configure_search(index, spec: IndexSpec):
+    if spec.index_type in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = spec.nprobe
+    elif spec.index_type == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = spec.ef_search
+
+
+class TruncatedEmbeddings(Embeddings):
+    """
+    Embeds with the wrapped model, then truncates and re-normalizes vectors to
+    match an index built on reduced dimensions.
+    """
+
+    def __init__(self, underlying: Embeddings, dimensions: int):
+        self.underlying = underlying
+        self.dimensions = dimensions
+
+    def _reduce(self, vectors: list) -> list:
+        return reduce_dimensions(np.asarray(vectors, dtype="float32"), self.dimensions).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return self._reduce(self.underlying.embed_documents(texts))
+
+    def embed_query(self, text: str) -> list:
+        return self._reduce([self.underlying.embed_query(text)])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        return self._reduce(await self.underlying.aembed_documents(texts))
+
+    async def aembed_query(self, text: str) -> list:
+        return self._reduce([await self.underlying.aembed_query(text)])[0]
+
+    async def aembed_queries(self, texts: list) -> list:
+        embed_queries = getattr(self.underlying, "aembed_queries", self.underlying.aembed_documents)
+        return self._reduce(await embed_queries(texts))
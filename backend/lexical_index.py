@@ -0,0 +1,132 @@
+"""
+BM25 inverted index over the chunks of the compact index.
+
+Chunk i of the lexical index is chunk i of the compact index, so both share
+the CompactDocstore. The index is stored next to the compact files:
+
+    bm25.json          vocabulary (term id = list position) and BM25 parameters
+    bm25_offsets.npy   start of each term's postings; term t owns [offsets[t], offsets[t + 1])
+    bm25_docs.npy      chunk position of each posting
+    bm25_weights.npy   precomputed BM25 score contribution of each posting
+
+Because weights are precomputed, a search is one vectorized add per query
+term plus a partial sort, with no network round trip.
+"""
+from collections import Counter
+from pathlib import Path
+import json
+import re
+import numpy as np
+
+BM25_FORMAT_VERSION = 1
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Terms so common that their postings cost more to scan than they add to ranking
+STOPWORDS = frozenset("""
+a an and are as at be but by for from had has have he her him his i if in into is it its
+me my no not of on or our she so than that the their them then there these they this to
+was we were what when which who will with would you your
+""".split())
+
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def is_lexical_index(index_dir: Path) -> bool:
+    return (Path(index_dir) / "bm25.json").exists()
+
+
+class BM25Index:
+    def __init__(self, vocab: list, offsets, docs, weights, count: int, params: dict):
+        self.terms = {term: term_id for term_id, term in enumerate(vocab)}
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.count = count
+        self.params = params
+
+    @classmethod
+    def build(cls, texts: list, k1: float = 1.5, b: float = 0.75):
+        vocab, term_ids = [], {}
+        posting_terms, posting_docs, posting_tfs = [], [], []
+        lengths = np.zeros(len(texts), dtype="float32")
+
+        for position, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[position] = sum(counts.values())
+            for term, tf in counts.items():
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(vocab)
+                    vocab.append(term)
+                posting_terms.append(term_id)
+                posting_docs.append(position)
+                posting_tfs.append(tf)
+
+        posting_terms = np.asarray(posting_terms, dtype="int64")
+        order = np.argsort(posting_terms, kind="stable")
+        posting_terms = posting_terms[order]
+        docs = np.asarray(posting_docs, dtype="uint32")[order]
+        tfs = np.asarray(posting_tfs, dtype="float32")[order]
+
+        df = np.bincount(posting_terms, minlength=len(vocab))
+        offsets = np.zeros(len(vocab) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(df)
+
+        count = len(texts)
+        avgdl = float(lengths.mean()) if count and lengths.any() else 1.0
+        idf = np.log1p((count - df + 0.5) / (df + 0.5)).astype("float32")
+        norm = k1 * (1 - b + b * lengths[docs] / avgdl)
+        weights = (idf[posting_terms] * tfs * (k1 + 1) / (tfs + norm)).astype("float32")
+
+        params = {"k1": k1, "b": b, "avgdl": avgdl}
+        return cls(vocab, offsets, docs, weights, count, params)
+
+    def save(self, out_dir: Path):
+        out_dir = Path(out_dir)
+        np.save(out_dir / "bm25_offsets.npy", self.offsets)
+        np.save(out_dir / "bm25_docs.npy", self.docs)
+        np.save(out_dir / "bm25_weights.npy", self.weights)
+        # Written last: its presence marks a complete index
+        with open(out_dir / "bm25.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "format": BM25_FORMAT_VERSION,
+                "count": self.count,
+                **self.params,
+                "vocab": self.vocab,
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir: Path):
+        index_dir = Path(index_dir)
+        with open(index_dir / "bm25.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            meta["vocab"],
+            np.load(index_dir / "bm25_offsets.npy", mmap_mode="r"),
+            np.load(index_dir / "bm25_docs.npy", mmap_mode="r"),
+            np.load(index_dir / "bm25_weights.npy", mmap_mode="r"),
+            meta["count"],
+            {key: meta[key] for key in ("k1", "b", "avgdl")},
+        )
+
+    def search(self, query: str, k: int = 4) -> list:
+        """
+        Returns up to k (chunk position, score) pairs, best first.
+        """
+        term_ids = {self.terms[token] for token in tokenize(query) if token in self.terms}
+        if not term_ids or not self.count:
+            return []
+
+        scores = np.zeros(self.count, dtype="float32")
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # A chunk appears at most once per term, so plain fancy-index add is safe
+            scores[self.docs[start:end]] += self.weights[start:end]
+
+        k = min(k, self.count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(position), float(scores[position])) for position in top if scores[position] > 0]
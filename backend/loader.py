@@ -1,34 +1,165 @@
-from langchain_community.document_loaders import TextLoader
+"""
+Chunking pipeline for the corpus.
+
+iter_file_chunks streams the .txt files through a process pool (for
+corpora large enough to pay for starting one): up to `workers` files are
+split at once, each file is read only by the worker that splits it, and
+chunks come back one file at a time in the order the files were given.
+iter_chunk_batches regroups them into batches sized for the embedder, so
+indexing starts with the first file instead of after the last.
+
+Chunks whose exact text was already produced (Project Gutenberg headers and
+licences repeated in every book, for example) are dropped. A chunk dropped
+because another file has the same text is reported as shared: the file
+refers to that file's chunk ID instead, so the index builder can tell which
+files depend on a file it removes (see index_builder.py). Each chunk's ID
+depends only on its file's content hash and its position in the file, so it
+is stable across runs.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from drive_loader import CACHE_DIR
 from pathlib import Path
+import hashlib
+import multiprocessing
+import os
 
-# Load and split
-def load_and_chunk_documents():
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "0")) or os.cpu_count() or 1
+# Splitting runs at roughly 20 MB/s per core and starting a worker costs about
+# a second of imports, so smaller corpora are split in-process
+CHUNK_POOL_MIN_BYTES = int(os.getenv("CHUNK_POOL_MIN_BYTES", str(32 * 2**20)))
+AUTHOR = "Dostoevsky"
+
+
+def get_text_splitter():
+    # start_index records where each chunk begins in its source file
+    return RecursiveCharacterTextSplitter(
+        chunk_size = CHUNK_SIZE,
+        chunk_overlap = CHUNK_OVERLAP,
+        add_start_index = True
+    )
+
+
+def split_text_file(path: str) -> list:
+    """
+    Splits one file into (start_index, text) pairs. Runs in pool workers, so
+    it takes and returns plain values.
     """
-    Loads all .txt files from CACHE_DIR, adds metadata, splits into chunks.
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    return [(doc.metadata["start_index"], doc.page_content) for doc in get_text_splitter().create_documents([text])]
 
-    Returns:
-        List of Document objects: Chunked text pieces with metadata.
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(file_hash: str, position: int) -> str:
+    # Only depends on file content, so unchanged files keep their IDs
+    return f"{file_hash[:16]}-{position:05d}"
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()[:16]
+
+
+def make_chunks(path: Path, file_hash: str, pieces: list, seen: dict) -> tuple:
     """
+    Returns (chunks, shared_ids): the file's new chunks, and the IDs of other
+    files' chunks with the text of the ones dropped. seen maps text_key()s to
+    chunk IDs and is extended with the new chunks.
+    """
+    chunks, shared_ids, own = [], [], set()
+    for position, (start, text) in enumerate(pieces):
+        key = text_key(text)
+        if key in own:
+            continue
+        own.add(key)
+        if key in seen:
+            shared_ids.append(seen[key])
+            continue
+        chunks.append(Document(
+            id=chunk_id(file_hash, position),
+            page_content=text,
+            metadata={"source": path.name, "author": AUTHOR, "start_index": start},
+        ))
+        seen[key] = chunks[-1].id
+    return chunks, shared_ids
 
-    print("Loading manually from:", CACHE_DIR)
 
-    docs = []
-    for file in Path(CACHE_DIR).glob("*.txt"):
-        loader = TextLoader(str(file), encoding="utf-8")
-        raw_docs = loader.load()
+def iter_file_chunks(files: list, workers: int = CHUNK_WORKERS, seen: dict = None):
+    """
+    Yields (path, chunks, shared_ids) for each (path, file_hash) in files, in
+    order (see make_chunks).
 
-        # Metadata
-        for doc in raw_docs:
-            doc.metadata["source"] = file.name
-            doc.metadata["author"] = "Dostoevsky"
+    seen maps text_key()s of chunks that already exist (for example in an
+    index being updated) to their IDs; it is extended as chunks are produced.
+    Corpora under CHUNK_POOL_MIN_BYTES are split in this process.
+    """
+    seen = {} if seen is None else seen
+    total_bytes = sum(path.stat().st_size for path, _ in files)
+    if workers <= 1 or len(files) <= 1 or total_bytes < CHUNK_POOL_MIN_BYTES:
+        for path, file_hash in files:
+            yield path, *make_chunks(path, file_hash, split_text_file(str(path)), seen)
+        return
 
-        docs.extend(raw_docs)
+    # Spawned, not forked: callers such as the index builder run threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        files = iter(files)
+        pending = deque()
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size = 1000, 
-        chunk_overlap = 200
-    )
+        def submit():
+            for path, file_hash in files:
+                pending.append((path, file_hash, pool.submit(split_text_file, str(path))))
+                return
+
+        # Read-ahead is bounded, so at most 2 * workers split files wait in memory
+        for _ in range(2 * workers):
+            submit()
+        while pending:
+            path, file_hash, future = pending.popleft()
+            pieces = future.result()
+            submit()
+            yield path, *make_chunks(path, file_hash, pieces, seen)
+
+
+def iter_chunk_batches(files: list, batch_size: int, workers: int = CHUNK_WORKERS, seen: dict = None):
+    """
+    Yields (chunks, finished) with len(chunks) <= batch_size. finished lists
+    (path, chunk_ids, shared_ids) for files whose last chunk is in this batch
+    or an earlier one.
+    """
+    batch, finished = [], []
+    for path, chunks, shared_ids in iter_file_chunks(files, workers, seen):
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                yield batch, finished
+                batch, finished = [], []
+        finished.append((path, [chunk.id for chunk in chunks], shared_ids))
+    if batch or finished:
+        yield batch, finished
+
+
+# Load and split
+def load_and_chunk_documents(data_dir: Path = CACHE_DIR):
+    """
+    Loads all .txt files from data_dir, adds metadata, splits into chunks.
+
+    Returns:
+        List of Document objects: Chunked text pieces with metadata.
+    """
+
+    print("Loading manually from:", data_dir)
 
-    return text_splitter.split_documents(docs)
\ No newline at end of file
+    files = [(path, file_sha256(path)) for path in sorted(Path(data_dir).glob("*.txt"))]
+    return [chunk for _, chunks, _ in iter_file_chunks(files) for chunk in chunks]
@@ -1,22 +1,236 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from retriever import build_retriever
+from retriever import HybridRetriever, build_retriever, has_local_index, load_retriever
+from index_builder import INDEX_DIR, build_index, current_compact_dir, current_version, prune_versions
 from langchain_openai import ChatOpenAI
-from langchain_classic.chains.conversational_retrieval.base import ConversationalRetrievalChain
+from followup import FollowUpRetrievalChain
 from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from fastapi.middleware.cors import CORSMiddleware
 from langchain_core.messages import HumanMessage, AIMessage
-from langdetect import detect
+from langchain_core.documents import Document
+from language import DEFAULT_LANGUAGE, LANGUAGE_NAMES, LanguageDetector
 from drive_loader import download_missing_files
-from db import AsyncSessionLocal
+from db import AsyncSessionLocal, engine
 from models import ChatHistory
+from answer_cache import SemanticAnswerCache
+from history_writer import ChatHistoryWriter
+from session_store import SessionHistoryStore
+from history_reader import history_page
+from hot_answers import HOT_ANSWERS_PATH, HotAnswers, normalize_question
+from embedding_cache import CachedEmbeddings, get_embeddings
+from singleflight import SingleFlight
+from batch import BATCH_CONCURRENCY, BATCH_MAX_QUESTIONS, run_batch, save_rows
+from metrics import LLMMetricsCallback, TimingMiddleware, annotate, cache_event, current_timings, index_loaded, metrics_payload, register_stats, stage
+from contextlib import asynccontextmanager, contextmanager
+from typing import Literal
+from sqlalchemy import text
+import asyncio
 import os
 import json
+import secrets
+import time
 
 load_dotenv()
 
-app = FastAPI()
+# Startup: the port is bound immediately and the index loads in the background.
+# With INDEX_LOCAL_ONLY, Google Drive is never contacted when a local index exists.
+INDEX_LOCAL_ONLY = os.getenv("INDEX_LOCAL_ONLY", "false").lower() == "true"
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "30"))
+
+retriever = None
+chain = None
+hot_answers = None
+startup_state = {"ready": False, "preloaded": False, "phases": {}, "error": None}
+
+
+@contextmanager
+def startup_phase(name: str):
+    print(f"[STARTUP] {name}...")
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        startup_state["phases"][name] = round(elapsed, 3)
+        print(f"[STARTUP] {name} took {elapsed:.2f}s")
+
+
+async def load_serving_state():
+    """
+    Syncs texts from Drive, loads the index and builds the chain. Drive
+    failures are logged, not fatal.
+    """
+    global retriever, chain, hot_answers
+
+    if INDEX_LOCAL_ONLY and has_local_index():
+        print("[STARTUP] Local-only mode: skipping Google Drive sync")
+    else:
+        with startup_phase("sync_texts"):
+            try:
+                await asyncio.to_thread(download_missing_files)
+            except Exception as e:
+                print(f"[STARTUP] Google Drive sync failed, using local files: {e}")
+
+    with startup_phase("load_language_profiles"):
+        await asyncio.to_thread(language_detector.load)
+
+    with startup_phase("load_index"):
+        retriever = await asyncio.to_thread(build_retriever)
+
+    with startup_phase("build_chain"):
+        chain = build_chain(retriever)
+
+    if HOT_ANSWERS_ENABLED:
+        with startup_phase("load_hot_answers"):
+            hot_answers = await asyncio.to_thread(load_hot_answers, retriever.version)
+
+    index_state["version"] = retriever.version
+    index_loaded(retriever.version)
+    startup_state["ready"] = True
+    startup_state["error"] = None
+    print("[STARTUP] Ready to serve chats")
+
+
+async def warm_up():
+    """
+    Runs load_serving_state in the background, retrying until it succeeds.
+    """
+    while True:
+        try:
+            await load_serving_state()
+            return
+        except Exception as e:
+            startup_state["error"] = str(e)
+            print(f"[STARTUP] Warm-up failed, retrying in {WARMUP_RETRY_SECONDS:.0f}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+
+def preload() -> bool:
+    """
+    Loads the index in a pre-fork server's master process (see
+    gunicorn.conf.py), so forked workers share it instead of each loading
+    their own copy. Returns False on failure; workers then warm up on their own.
+    """
+    try:
+        asyncio.run(load_serving_state())
+    except Exception as e:
+        startup_state["error"] = str(e)
+        print(f"[STARTUP] Preload failed, workers will load the index themselves: {e}")
+        return False
+    startup_state["preloaded"] = True
+    return True
+
+
+# Hot reload: a new index version (see index_builder.py) is loaded in the
+# background, checked with a smoke query and swapped in. Requests already
+# running finish on the retriever and chain they started with.
+INDEX_RELOAD_TOKEN = os.getenv("INDEX_RELOAD_TOKEN", "")
+INDEX_WATCH_SECONDS = float(os.getenv("INDEX_WATCH_SECONDS", "0"))
+INDEX_SMOKE_QUERY = os.getenv("INDEX_SMOKE_QUERY", "What does Ivan Karamazov say about suffering?")
+
+index_state = {"version": None, "reloads": 0, "failed_reloads": 0, "last_error": None}
+index_reload_lock = asyncio.Lock()
+
+
+async def smoke_test(candidate: HybridRetriever):
+    """
+    Fails unless the candidate answers the smoke query with chunks from its
+    own docstore.
+    """
+    docs = await candidate.ainvoke(INDEX_SMOKE_QUERY)
+    if not docs:
+        raise ValueError("the smoke query returned no documents")
+    if not all(isinstance(doc, Document) for doc in docs):
+        raise ValueError("the smoke query returned chunks missing from the docstore")
+
+
+async def reload_index(rebuild: bool = False) -> dict:
+    """
+    Swaps in the current index version if it is not the one being served,
+    after updating the index from the texts in DATA_DIR if rebuild is set.
+    If the new version fails to load or to answer the smoke query, the old
+    one keeps serving and the error is raised.
+    """
+    global retriever, chain, hot_answers
+
+    async with index_reload_lock:
+        previous = retriever.version
+        started = time.perf_counter()
+        try:
+            if rebuild:
+                await build_index(INDEX_DIR)
+            compact_dir = current_compact_dir(INDEX_DIR)
+            if compact_dir is None:
+                raise FileNotFoundError(f"no index in {INDEX_DIR}")
+            if compact_dir.name == previous:
+                return {"reloaded": False, "version": previous}
+
+            candidate = await asyncio.to_thread(load_retriever, compact_dir)
+            await smoke_test(candidate)
+            candidate_chain = build_chain(candidate)
+            candidate_hot_answers = None
+            if HOT_ANSWERS_ENABLED:
+                candidate_hot_answers = await asyncio.to_thread(load_hot_answers, candidate.version)
+        except Exception as e:
+            index_state["failed_reloads"] += 1
+            index_state["last_error"] = str(e)
+            raise
+
+        # Nothing awaits in between, so every request sees the old state or the new one.
+        # Cached answers were generated from the old index's context.
+        retriever, chain, hot_answers = candidate, candidate_chain, candidate_hot_answers
+        if answer_cache is not None:
+            answer_cache.clear()
+        elapsed = time.perf_counter() - started
+        index_state.update(version=candidate.version, reloads=index_state["reloads"] + 1, last_error=None)
+        index_loaded(candidate.version)
+        print(f"[INDEX] Serving index version {candidate.version} (was {previous}), swapped in after {elapsed:.2f}s")
+
+        await asyncio.to_thread(prune_versions, INDEX_DIR, protect=(candidate.version,))
+        return {"reloaded": True, "version": candidate.version, "previous": previous, "seconds": round(elapsed, 3)}
+
+
+async def watch_index():
+    """
+    Reloads whenever current.json names a new version, so every worker follows
+    a build made by index_builder.py or by another worker's reload.
+    """
+    failed_version = None
+    while True:
+        await asyncio.sleep(INDEX_WATCH_SECONDS)
+        if not startup_state["ready"] or index_reload_lock.locked():
+            continue
+        version = None
+        try:
+            version = current_version(INDEX_DIR)
+            if version is None or version in (retriever.version, failed_version):
+                continue
+            await reload_index()
+        except Exception as e:
+            # Not retried until another version is published
+            failed_version = version
+            print(f"[INDEX] Reloading version {version} failed, still serving {retriever.version}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Already loaded when the worker was forked from a preloaded master
+    warm_up_task = None if startup_state["ready"] else asyncio.create_task(warm_up())
+    watch_task = asyncio.create_task(watch_index()) if INDEX_WATCH_SECONDS > 0 else None
+    if history_writer is not None:
+        await history_writer.start()
+    yield
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    if watch_task is not None:
+        watch_task.cancel()
+    if history_writer is not None:
+        await history_writer.stop(timeout=HISTORY_DRAIN_TIMEOUT)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow frontend hosted on Vercel
 app.add_middleware(
@@ -25,11 +239,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# Download text files and build retriever
-download_missing_files()
-retriever = build_retriever()
+# Per-stage timings: Server-Timing headers, /metrics and the slow-request log
+app.add_middleware(TimingMiddleware)
 
 system_prompt = ChatPromptTemplate.from_messages([
     SystemMessagePromptTemplate.from_template(template=
@@ -46,23 +260,124 @@ RESPONSE GUIDELINES:
 Context from Dostoevsky's texts (use when relevant):
 {context}
 
+Conversation so far:
+{chat_history}
+
+Always respond in {language}.
+
 If the user shows signs of crisis, recommend professional help."""
     ),
     HumanMessagePromptTemplate.from_template("{question}")
 ])
 
+# The answering model is tagged so its tokens can be told apart from the
+# question-condensing call when streaming.
+ANSWER_TAG = "answer"
+
 llm = ChatOpenAI(
     temperature=0.3,
     model="gpt-4o-mini",
-    max_completion_tokens=250
+    max_completion_tokens=250,
+    tags=[ANSWER_TAG],
+    # Token usage is reported for streamed answers too
+    stream_usage=True,
+    callbacks=[LLMMetricsCallback("completion")],
 )
 
-chain = ConversationalRetrievalChain.from_llm(
-    llm=llm,
-    retriever=retriever,
-    combine_docs_chain_kwargs={"prompt": system_prompt}
+condense_llm = ChatOpenAI(
+    temperature=0.3,
+    model="gpt-4o-mini",
+    max_completion_tokens=250,
+    callbacks=[LLMMetricsCallback("condense")],
 )
 
+
+# Follow-ups: how the retrieval query is formed when there is chat history
+# (see followup.py), and how much history is sent to the models.
+FOLLOWUP_STRATEGY = os.getenv("FOLLOWUP_STRATEGY", "condense").lower()
+FOLLOWUP_LOCAL_TURNS = int(os.getenv("FOLLOWUP_LOCAL_TURNS", "2"))
+FOLLOWUP_RACE_TIMEOUT = float(os.getenv("FOLLOWUP_RACE_TIMEOUT", "1.5"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+
+# Retrieved chunks are merged, deduplicated and fitted to a budget (see context.py)
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+
+def build_chain(retriever):
+    return FollowUpRetrievalChain.from_llm(
+        llm=llm,
+        retriever=retriever,
+        condense_question_llm=condense_llm,
+        combine_docs_chain_kwargs={"prompt": system_prompt},
+        followup_strategy=FOLLOWUP_STRATEGY,
+        local_turns=FOLLOWUP_LOCAL_TURNS,
+        race_timeout=FOLLOWUP_RACE_TIMEOUT,
+        history_token_budget=HISTORY_TOKEN_BUDGET,
+        context_packing=CONTEXT_PACKING,
+        context_token_budget=CONTEXT_TOKEN_BUDGET,
+        duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD,
+    )
+
+
+def require_chain():
+    if chain is None:
+        raise HTTPException(status_code=503, detail="The index is still loading, please retry shortly.")
+    return chain
+
+# Precomputed answers for the most asked first-turn questions (see hot_answers.py)
+HOT_ANSWERS_ENABLED = os.getenv("HOT_ANSWERS_ENABLED", "true").lower() == "true"
+
+
+def load_hot_answers(index_version: str):
+    """
+    The hot answers artifact, or None if there is none or it was generated
+    from another index version than index_version.
+    """
+    answers = HotAnswers.load(HOT_ANSWERS_PATH)
+    if answers is None:
+        return None
+    if answers.index_version != index_version:
+        print(f"[HOT] Ignoring {HOT_ANSWERS_PATH}: generated from index version {answers.index_version}, "
+              f"serving {index_version}. Re-run hot_answers.py")
+        return None
+    print(f"[HOT] Loaded {len(answers.entries)} precomputed answers (version {answers.version})")
+    return answers
+
+
+# Semantic cache for first-turn answers
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+
+answer_cache = SemanticAnswerCache(
+    embeddings=get_embeddings(),
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+    ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL", "21600")),
+    max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000")),
+) if SEMANTIC_CACHE_ENABLED else None
+
+# Concurrency cap: requests beyond the limit wait for a free slot instead of
+# piling more work onto the event loop and the OpenAI connection pool.
+MAX_CONCURRENT_CHATS = int(os.getenv("MAX_CONCURRENT_CHATS", "32"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "30"))
+chat_slots = asyncio.Semaphore(MAX_CONCURRENT_CHATS)
+
+
+@asynccontextmanager
+async def chat_slot():
+    """
+    Waits for a free chat slot, failing with 503 after CHAT_QUEUE_TIMEOUT seconds.
+    """
+    try:
+        with stage("queue"):
+            await asyncio.wait_for(chat_slots.acquire(), timeout=CHAT_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly.")
+    try:
+        yield
+    finally:
+        chat_slots.release()
+
 # Request model for the /chat endpoint
 class ChatMessage(BaseModel):
     role: str
@@ -71,67 +386,393 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     session_id: str
     question: str
+    # Deprecated: the server keeps each session's history. Only used if sent.
     chat_history: list = []
 
+class BatchQuestion(BaseModel):
+    question: str
+    id: str | None = None
+    session_id: str | None = None
+
+class BatchChatRequest(BaseModel):
+    questions: list[str | BatchQuestion]
+    save_history: bool = False
+    # Session the saved turns belong to, unless a question names its own
+    session_id: str | None = None
+    concurrency: int | None = None
+
 # Agent's "brain"
-def run_philosophy_agent(question: str, chat_history: list):
+language_detector = LanguageDetector(
+    min_confidence=float(os.getenv("LANGUAGE_MIN_CONFIDENCE", "0.7")),
+    max_sessions=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+)
+
+
+async def detect_language(session_id: str, question: str) -> str:
+    with stage("language"):
+        return await language_detector.detect_for_session(session_id, question)
+
+
+def build_chain_inputs(question: str, chat_history: list, language: str) -> dict:
+    """
+    Formats the chat history and names the answer language. The question is
+    passed as asked so it can be used as a retrieval query unchanged.
+    """
     formatted_history = []
     for role, content in chat_history:
         if role == "user":
             formatted_history.append(HumanMessage(content=content))
         elif role == "assistant":
             formatted_history.append(AIMessage(content=content))
-        
-    language = detect(question)
-    language_map = {
-        "en": "English",
-        "pt": "Portuguese",
-        "it": "Italian",
+
+    language_name = LANGUAGE_NAMES.get(language, LANGUAGE_NAMES[DEFAULT_LANGUAGE])
+
+    return {
+        "question": question,
+        "chat_history": formatted_history,
+        "language": language_name,
     }
-    language_name = language_map.get(language, "English")
 
-    full_question = f"Please respond in {language_name}. {question}"
 
-    return chain.invoke({
-        "question": full_question,
-        "chat_history": formatted_history
-    })
+async def lookup_cached_answer(question: str, chat_history: list, language: str):
+    """
+    Returns (answer, vector) from the precomputed hot answers or the semantic
+    cache; vector is None unless the semantic cache was searched. Only
+    first-turn questions are cached, since follow-ups depend on the
+    conversation so far.
+    """
+    if chat_history:
+        return None, None
+    if hot_answers is not None:
+        answer = hot_answers.lookup(question, language)
+        cache_event("hot", answer is not None)
+        if answer is not None:
+            return answer, None
+    # While the index loads the request ends in a 503 anyway: don't spend an embedding call first
+    if answer_cache is None or chain is None:
+        return None, None
+    embed_query = None
+    if isinstance(retriever, HybridRetriever):
+        # Retrieval is running without the embedding API; don't wait on it here either
+        if not retriever.embeddings_available():
+            return None, None
+        # Same timeout and cooldown as retrieval: a slow embedding API skips the cache
+        embed_query = retriever.aembed_query
+    with stage("cache_lookup"):
+        cached, vector = await answer_cache.lookup(question, language, embed_query)
+    if vector is None:
+        return None, None
+    cache_event("semantic", cached is not None)
+    return cached, vector
 
-# Chat history
-CHAT_HISTORY_DIR = "chat_sessions"
-os.makedirs(CHAT_HISTORY_DIR, exist_ok=True)
 
+def cache_answer(active_chain, language: str, vector, question: str, answer: str):
+    """
+    Stores a first-turn answer in the semantic cache, unless the index was
+    swapped while it was being generated.
+    """
+    if vector is not None and active_chain is chain:
+        answer_cache.store(language, vector, question, answer)
 
-def load_session_history(session_id: str) -> list:
-    path = os.path.join(CHAT_HISTORY_DIR, f"{session_id}.json")
-    if os.path.exists(path):
-        with open(path, "r", encoding="uft-8") as f:
-            return json.load(f)
-    return []
 
+# Identical first-turn questions asked at the same time share one answer
+# (see singleflight.py); each request still saves its own history row
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+answer_flights = SingleFlight("answer")
 
-def save_session_history(session_id: str, chat_history: list):
-    path = os.path.join(CHAT_HISTORY_DIR, f"{session_id}.json")
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(chat_history, f, ensure_ascii=False, indent=2)
 
-# Request handling
-@app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
-    """
-    This endpoint receives a question and an optional chat history,
-    then returns a response generated from the preloaded document.
-    """
-    session_id = request.session_id
+async def answer_question(question: str, chat_history: list, language: str) -> dict:
+    cached, vector = await lookup_cached_answer(question, chat_history, language)
+    if cached is not None:
+        return {"answer": cached}
+
+    active_chain = require_chain()
+    result = await active_chain.ainvoke(build_chain_inputs(question, chat_history, language))
+    cache_answer(active_chain, language, vector, question, result["answer"])
+    return result
+
+
+async def run_philosophy_agent(session_id: str, question: str, chat_history: list):
+    language = await detect_language(session_id, question)
+
+    if COALESCE_REQUESTS and not chat_history:
+        key = (normalize_question(question), language)
+        return await answer_flights.run(key, answer_question, question, chat_history, language)
+    return await answer_question(question, chat_history, language)
+
+
+# Chat history is written behind the response in batches (see history_writer.py)
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_DRAIN_TIMEOUT = float(os.getenv("HISTORY_DRAIN_TIMEOUT", "30"))
+
+history_writer = ChatHistoryWriter(
+    AsyncSessionLocal,
+    max_queue=int(os.getenv("HISTORY_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("HISTORY_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5")),
+) if HISTORY_WRITE_BEHIND else None
+
+
+# Recent turns per session, kept in memory and loaded from chat_history on a miss
+session_history = SessionHistoryStore(
+    AsyncSessionLocal,
+    max_sessions=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+    max_turns=int(os.getenv("SESSION_HISTORY_TURNS", "10")),
+    ttl_seconds=float(os.getenv("SESSION_CACHE_TTL", "600")),
+)
+
 
-    result = run_philosophy_agent(request.question, request.chat_history)
+async def get_chat_history(request: ChatRequest) -> list:
+    if request.chat_history:
+        return request.chat_history
+    with stage("history"):
+        return await session_history.get(request.session_id)
+
+
+async def save_chat_history(session_id: str, question: str, answer: str):
+    session_history.append(session_id, question, answer)
+    if history_writer is not None:
+        await history_writer.put(session_id, question, answer)
+        return
 
     async with AsyncSessionLocal() as session:
         session.add(ChatHistory(
             session_id=session_id,
-            user_message=request.question,
-            bot_response = result["answer"]
+            user_message=question,
+            bot_response=answer
         ))
         await session.commit()
 
+
+HISTORY_PAGE_MAX = 200
+
+
+@app.get("/sessions/{session_id}/history")
+async def session_history_endpoint(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=HISTORY_PAGE_MAX),
+    cursor: str | None = None,
+    order: Literal["desc", "asc"] = "desc",
+):
+    """
+    A session's stored turns, newest first (or oldest first with order=asc),
+    `limit` at a time. Pass the returned next_cursor to get the next page;
+    it is null on the last one. With HISTORY_WRITE_BEHIND, the latest turns
+    appear once they are flushed.
+    """
+    try:
+        return await history_page(AsyncSessionLocal, session_id, limit, cursor, newest_first=order == "desc")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat")
+async def chat_endpoint(request: ChatRequest):
+    """
+    This endpoint receives a question for a session, then returns a response
+    generated from the preloaded document. The session's earlier turns are
+    kept by the server.
+    """
+    session_id = request.session_id
+    if chain is not None:
+        annotate("index", chain.retriever.version)
+
+    async with chat_slot():
+        chat_history = await get_chat_history(request)
+        result = await run_philosophy_agent(session_id, request.question, chat_history)
+        await save_chat_history(session_id, request.question, result["answer"])
+
     return {"answer": result["answer"]}
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """
+    Same as /chat, but streams the answer as Server-Sent Events:
+    one "token" event per generated token, then a "done" event with the full answer.
+    The exchange is persisted only once the stream completes; if the client
+    disconnects, the upstream generation is cancelled and nothing is stored.
+    """
+    active_chain = require_chain()
+    index_version = active_chain.retriever.version
+    annotate("index", index_version)
+
+    async def event_stream():
+        try:
+            async with chat_slot():
+                language = await detect_language(request.session_id, request.question)
+                chat_history = await get_chat_history(request)
+
+                cached, vector = await lookup_cached_answer(request.question, chat_history, language)
+                if cached is not None:
+                    await save_chat_history(request.session_id, request.question, cached)
+                    yield sse_event("token", {"token": cached})
+                    yield sse_event("done", {"answer": cached})
+                    return
+
+                inputs = build_chain_inputs(request.question, chat_history, language)
+                tokens = []
+                events = active_chain.astream_events(inputs, version="v2")
+                try:
+                    async for event in events:
+                        if await http_request.is_disconnected():
+                            print(f"[STREAM] Client disconnected, cancelling session {request.session_id}")
+                            return
+                        if event["event"] != "on_chat_model_stream" or ANSWER_TAG not in event["tags"]:
+                            continue
+                        token = event["data"]["chunk"].content
+                        if token:
+                            tokens.append(token)
+                            yield sse_event("token", {"token": token})
+                finally:
+                    # Closing the event stream cancels the in-flight OpenAI request
+                    await events.aclose()
+
+                answer = "".join(tokens)
+                cache_answer(active_chain, language, vector, request.question, answer)
+                await save_chat_history(request.session_id, request.question, answer)
+                yield sse_event("done", {"answer": answer, "index_version": index_version, "timings": current_timings()})
+        except HTTPException as e:
+            yield sse_event("error", {"detail": e.detail})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def save_batch_history(rows: list):
+    for row in rows:
+        session_history.append(row["session_id"], row["user_message"], row["bot_response"])
+    await save_rows(rows, AsyncSessionLocal)
+
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: BatchChatRequest):
+    """
+    Answers many first-turn questions at once (see batch.py). Streams one
+    JSON object per line as each answer completes, in completion order with
+    the question's index, then a summary line with "done": true. The
+    exchanges are stored only if save_history is set.
+    """
+    active_chain = require_chain()
+    index_version = active_chain.retriever.version
+    annotate("index", index_version)
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch.")
+
+    items = [
+        {"question": item} if isinstance(item, str) else item.model_dump()
+        for item in request.questions
+    ]
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    lines = run_batch(
+        active_chain, active_chain.retriever, language_detector, items, build_chain_inputs, concurrency,
+        save=save_batch_history if request.save_history else None,
+        session_id=request.session_id,
+    )
+
+    async def ndjson():
+        async for line in lines:
+            if line.get("done"):
+                line["index_version"] = index_version
+                print(f"[BATCH] {line['questions']} questions in {line['seconds']:.1f}s: "
+                      f"{line['answered']} answered, {line['failed']} failed, {line['saved']} saved")
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+def collect_stats() -> dict:
+    embeddings = get_embeddings()
+    return {
+        "hot_answers": hot_answers.stats() if hot_answers is not None else None,
+        "semantic_cache": answer_cache.stats() if answer_cache is not None else None,
+        "embedding_cache": embeddings.stats() if isinstance(embeddings, CachedEmbeddings) else None,
+        "retrieval": retriever.stats() if isinstance(retriever, HybridRetriever) else None,
+        "followup": chain.followup_stats.stats() if chain is not None else None,
+        "context": chain.context_stats.stats() if chain is not None else None,
+        "history_writer": history_writer.stats() if history_writer is not None else None,
+        "session_history": session_history.stats(),
+        "language": language_detector.stats(),
+        "coalescing": answer_flights.stats() if COALESCE_REQUESTS else None,
+        "index": index_state,
+    }
+
+
+register_stats(collect_stats)
+
+
+@app.post("/admin/reload-index")
+async def reload_index_endpoint(rebuild: bool = False, x_admin_token: str = Header(default="")):
+    """
+    Swaps in the current index version without a restart (see reload_index);
+    with rebuild=true, the index is first updated from the texts in DATA_DIR.
+    Requires INDEX_RELOAD_TOKEN, sent as X-Admin-Token. Only the worker that
+    receives the request reloads; the others follow within INDEX_WATCH_SECONDS.
+    """
+    if not INDEX_RELOAD_TOKEN or not secrets.compare_digest(x_admin_token, INDEX_RELOAD_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    require_chain()
+    if index_reload_lock.locked():
+        raise HTTPException(status_code=409, detail="An index reload is already running.")
+    try:
+        return await reload_index(rebuild)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving {retriever.version}: {e}")
+
+
+@app.get("/stats")
+async def stats_endpoint():
+    return collect_stats()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus metrics: per-stage latency histograms, token counts, cache
+    hits, requests in flight and the counters from /stats.
+    """
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness: the process is up and serving HTTP.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: the index is loaded and the database is reachable.
+    """
+    database_ok = True
+    try:
+        async with engine.connect() as conn:
+            await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout=2)
+    except Exception:
+        database_ok = False
+
+    ready = startup_state["ready"] and database_ok
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "ready": ready,
+            "index_loaded": startup_state["ready"],
+            "preloaded": startup_state["preloaded"],
+            "index_version": index_state["version"],
+            "worker_pid": os.getpid(),
+            "database": database_ok,
+            "startup_phases": startup_state["phases"],
+            "error": startup_state["error"],
+        },
+    )
@@ -0,0 +1,303 @@
+"""
+Per-stage request instrumentation.
+
+Code on the hot path wraps each stage in `stage(name)`. A stage's duration
+is observed in the chat_stage_seconds histogram and, when it runs inside an
+HTTP request, added to that request's timings. TimingMiddleware returns a
+request's timings in a Server-Timing header and can log slow requests with
+their breakdown.
+
+Stages: queue (waiting for a chat slot), language, history, cache_lookup,
+condense, embed, search, bm25, pack, completion, db. Stages that run several
+times in a request (db statements, for example) are summed.
+
+Also recorded: LLM token counts (LLMMetricsCallback), context tokens saved
+by packing (context.py), cache hits and misses, requests in flight, and the
+index version served. `/metrics` serves all of it in the
+Prometheus text format, together with the numeric fields of /stats.
+
+Under gunicorn (see gunicorn.conf.py) PROMETHEUS_MULTIPROC_DIR is set and
+every worker writes its metrics there, so `/metrics` reports the sum over
+all workers whichever one answers the scrape. The /stats gauges are the
+answering worker's own and carry its pid as a label.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from dotenv import load_dotenv
+import os
+import re
+import time
+
+load_dotenv()
+
+# Requests slower than this are logged with their per-stage breakdown; 0 disables
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+
+# Set by gunicorn.conf.py: metrics are aggregated across worker processes
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Paths that are timed; health checks and /metrics itself are not
+TIMED_PATHS = ("/chat", "/chat/stream", "/chat/batch")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_seconds", "Time spent in each stage of a chat request", ["stage"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "chat_request_seconds", "Chat request latency, including streaming the body", ["path", "status"], buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge("chat_requests_in_flight", "Chat requests being processed", ["path"], multiprocess_mode="livesum")
+TOKENS = Counter("chat_llm_tokens_total", "Tokens used by LLM calls", ["call", "kind"])
+CACHE_EVENTS = Counter("chat_cache_events_total", "Cache lookups by result", ["cache", "result"])
+COALESCED_CALLS = Counter("chat_coalesced_calls_total", "Upstream calls saved by sharing an identical concurrent call", ["call"])
+# Same samples as an Info metric, which multiprocess mode does not support: 1 while a worker serves the version
+INDEX_INFO = Gauge("chat_index_info", "Index version being served", ["version"], multiprocess_mode="livemax")
+CONTEXT_TOKENS = Counter("chat_context_tokens_total", "Tokens of retrieved context, before and after packing", ["stage"])
+CONTEXT_TOKENS_SAVED = Histogram(
+    "chat_context_tokens_saved", "Context tokens removed by packing, per request", buckets=(0, 50, 100, 200, 400, 800, 1600, 3200),
+)
+
+_timings = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.notes = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.extend(f'{name};desc="{value}"' for name, value in self.notes.items())
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def current_timings() -> dict:
+    """
+    Stage durations so far in the current request, in milliseconds.
+    """
+    timings = _timings.get()
+    if timings is None:
+        return {}
+    return {name: round(seconds * 1000, 1) for name, seconds in timings.stages.items()}
+
+
+def observe(name: str, seconds: float):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the enclosed block as the named stage. Works around awaits.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def annotate(name: str, value):
+    """
+    Attaches a value to the current request: sent as a Server-Timing entry
+    without a duration and included in the slow-request log.
+    """
+    timings = _timings.get()
+    if timings is not None:
+        timings.notes[name] = value
+
+
+def context_packed(tokens_before: int, tokens_after: int):
+    CONTEXT_TOKENS.labels("retrieved").inc(tokens_before)
+    CONTEXT_TOKENS.labels("packed").inc(tokens_after)
+    CONTEXT_TOKENS_SAVED.observe(tokens_before - tokens_after)
+    annotate("context_tokens_saved", tokens_before - tokens_after)
+
+
+_served_version = None
+
+
+def index_loaded(version: str):
+    global _served_version
+    if _served_version is not None and _served_version != version:
+        if MULTIPROCESS:
+            # The sample stays in this worker's file; 0 marks the version as no longer served by it
+            INDEX_INFO.labels(_served_version).set(0)
+        else:
+            INDEX_INFO.remove(_served_version)
+    INDEX_INFO.labels(version).set(1)
+    _served_version = version
+
+
+def cache_event(cache: str, hit: bool):
+    CACHE_EVENTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Times LLM calls as a stage and counts their tokens. `call` names both,
+    e.g. "completion" for the answering model and "condense" for the
+    follow-up question rewrite.
+    """
+
+    run_inline = True
+
+    def __init__(self, call: str):
+        self.call = call
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            observe(self.call, time.perf_counter() - started)
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            # Streamed responses carry usage on the message instead
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    usage = {
+                        "prompt_tokens": metadata.get("input_tokens", 0),
+                        "completion_tokens": metadata.get("output_tokens", 0),
+                    }
+        for kind in ("prompt", "completion"):
+            if usage.get(f"{kind}_tokens"):
+                TOKENS.labels(self.call, kind).inc(usage[f"{kind}_tokens"])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+
+def instrument_engine(engine):
+    """
+    Times every statement run through a SQLAlchemy (async) engine as the "db"
+    stage.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        observe("db", time.perf_counter() - conn.info["query_started"].pop())
+
+
+class StatsCollector:
+    """
+    Exposes the numeric fields of a stats() dict as gauges named
+    chat_<section>_<field>, so /metrics carries the same counters as /stats.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def collect(self):
+        labels = {"pid": str(os.getpid())} if MULTIPROCESS else {}
+        for section, values in self.stats().items():
+            for name, value in _flatten(values):
+                metric = re.sub(r"[^a-zA-Z0-9_]", "_", f"chat_{section}_{name}")
+                family = GaugeMetricFamily(metric, f"{section} {name} (see /stats)", labels=list(labels))
+                family.add_metric(list(labels.values()), float(value))
+                yield family
+
+
+def _flatten(values, prefix: str = ""):
+    if isinstance(values, dict):
+        for key, value in values.items():
+            yield from _flatten(value, f"{prefix}{key}_" if isinstance(value, dict) else f"{prefix}{key}")
+    elif isinstance(values, (int, float)):
+        yield prefix, values
+
+
+_stats_collectors = []
+
+
+def register_stats(stats):
+    _stats_collectors.append(StatsCollector(stats))
+    if not MULTIPROCESS:
+        REGISTRY.register(_stats_collectors[-1])
+
+
+def metrics_payload() -> tuple:
+    """
+    Returns (body, content type) for the /metrics endpoint.
+    """
+    if not MULTIPROCESS:
+        return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    for collector in _stats_collectors:
+        registry.register(collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware for the chat endpoints: counts requests in flight, adds a
+    Server-Timing header with the stages finished before the response starts
+    and records the full request, body included, once it ends.
+
+    /chat/stream and /chat/batch send their headers before doing any work, so
+    their header only has the total; the stream's "done" event carries the
+    stages instead, and a batch's stages are in its [SLOW] line.
+    """
+
+    def __init__(self, app, slow_request_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in TIMED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        IN_FLIGHT.labels(path).inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            IN_FLIGHT.labels(path).dec()
+            _timings.reset(token)
+            elapsed = timings.elapsed()
+            REQUEST_SECONDS.labels(path, str(status)).observe(elapsed)
+            if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+                breakdown = " ".join(f"{name}={seconds:.3f}" for name, seconds in timings.stages.items())
+                breakdown += "".join(f" {name}={value}" for name, value in timings.notes.items())
+                print(f"[SLOW] {scope['method']} {path} {status} took {elapsed:.2f}s: {breakdown}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, timezone
 import uuid
@@ -13,5 +13,12 @@ class ChatHistory(Base):
     session_id = Column(String, index=True)
     user_message = Column(String)
     bot_response = Column(Text)
-    created_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc))
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Recent turns of a session, newest first, and keyset pages of them
+        Index("ix_chat_history_session_id_created_at_id", "session_id", "created_at", "id"),
+        # Exports by created_at range
+        Index("ix_chat_history_created_at_id", "created_at", "id"),
+    )
     
\ No newline at end of file
@@ -1,15 +1,43 @@
 from langchain_community.vectorstores import FAISS
-from langchain_openai.embeddings import OpenAIEmbeddings
 from dotenv import load_dotenv
 from drive_loader import download_missing_files, get_local_txt_files, download_faiss_index_from_drive, upload_faiss_index_to_drive
 from langchain_community.document_loaders import TextLoader
-from loader import load_and_chunk_documents
-from tqdm import tqdm
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import PrivateAttr
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from embedding_cache import get_embeddings
+from index_builder import INDEX_DIR, build_index, current_compact_dir, publish_compact
+from compact_index import load_compact
+from index_types import IndexSpec
+from lexical_index import BM25Index, is_lexical_index
+from sharded_index import SHARDS_DIRNAME, is_sharded_index, read_shards
+from shard_router import ShardRouter, load_curated_aliases
+from metrics import annotate, stage
 from pathlib import Path
+from typing import Any
+import asyncio
+import heapq
 import os
+import time
+import faiss
+import numpy as np
 
 load_dotenv()
 
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+RETRIEVAL_K = 4
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "2"))
+EMBEDDING_FALLBACK_COOLDOWN = float(os.getenv("EMBEDDING_FALLBACK_COOLDOWN", "30"))
+RRF_K = 60
+SHARD_ROUTING = os.getenv("SHARD_ROUTING", "true").lower() == "true"
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", "4"))
+
+_search_pool, _search_pool_pid = None, None
+
 def load_documents_from_drive():
     download_missing_files()
     paths = get_local_txt_files()
@@ -20,18 +48,342 @@ def load_documents_from_drive():
     return docs
 
 
+def has_local_index(index_dir: Path = INDEX_DIR) -> bool:
+    """
+    True if a complete index (compact or pickled) exists on local disk.
+    """
+    compact_dir = current_compact_dir(index_dir)
+    if compact_dir is not None and (is_sharded_index(compact_dir) or (compact_dir / "vectors.faiss").exists()):
+        return True
+    return (index_dir / "index.faiss").exists() and (index_dir / "index.pkl").exists()
+
+
+def reciprocal_rank_fusion(rankings: list, k: int, rrf_k: int = RRF_K) -> list:
+    """
+    Merges ranked document lists; a document scores sum(1 / (rrf_k + rank)).
+    """
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(doc.id, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[doc_id] for doc_id in best]
+
+
+@dataclass(eq=False)
+class Shard:
+    """
+    One searchable index: a shard of a sharded index (see sharded_index.py),
+    or a whole unsharded compact index.
+    """
+    name: str
+    store: Any
+    lexical: Any
+
+    def document(self, position: int) -> Document:
+        doc = self.store.docstore.search(str(position))
+        # Positions repeat across shards
+        doc.id = f"{self.name}:{position}"
+        return doc
+
+    def vector_search(self, matrix: np.ndarray, k: int) -> list:
+        """
+        (distance, shard, position) hits for each query row, best first.
+        """
+        distances, rows = self.store.index.search(matrix, k)
+        return [
+            [(float(distance), self, int(i)) for distance, i in zip(row_distances, row) if i >= 0]
+            for row_distances, row in zip(distances, rows)
+        ]
+
+    def lexical_search(self, query: str, k: int) -> list:
+        # Negated so that, as with distances, lower is better
+        return [(-score, self, position) for position, score in self.lexical.search(query, k)]
+
+
+def search_pool() -> ThreadPoolExecutor:
+    # Threads don't survive a fork: each gunicorn worker starts its own pool
+    global _search_pool, _search_pool_pid
+    if _search_pool is None or _search_pool_pid != os.getpid():
+        _search_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+        _search_pool_pid = os.getpid()
+    return _search_pool
+
+
+def fan_out(shards: list, search) -> list:
+    """
+    [search(shard) for shard in shards], on the search pool when there are
+    several. FAISS and numpy release the GIL, so shards are searched in
+    parallel.
+    """
+    if len(shards) == 1:
+        return [search(shards[0])]
+    return list(search_pool().map(search, shards))
+
+
+def top_hits(hit_lists: list, k: int) -> list:
+    hits = heapq.nsmallest(k, (hit for hits in hit_lists for hit in hits), key=lambda hit: hit[0])
+    return [shard.document(position) for _, shard, position in hits]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves from the FAISS index, the BM25 index, or both fused with
+    reciprocal rank fusion.
+
+    The index is a list of shards, one per book for a sharded index. If the
+    router finds works or characters named in the query (see
+    shard_router.py), only their shards are searched; otherwise all of them
+    are. Several shards are searched in parallel and their hits merged by
+    distance (BM25: by score).
+
+    In vector mode, a query embedding that fails or takes longer than
+    embedding_timeout falls back to BM25, and the vector path is skipped for
+    fallback_cooldown seconds so a degraded embedding API does not add its
+    timeout to every request.
+
+    version names the index version it serves (see index_builder.py).
+    """
+
+    shards: list
+    embeddings: Any
+    router: Any = None
+    version: str = ""
+    mode: str = "vector"
+    k: int = RETRIEVAL_K
+    embedding_timeout: float = EMBEDDING_TIMEOUT
+    fallback_cooldown: float = EMBEDDING_FALLBACK_COOLDOWN
+
+    _vector_down_until: float = PrivateAttr(default=0.0)
+    _counts: dict = PrivateAttr(default_factory=lambda: {"vector": 0, "lexical": 0, "hybrid": 0, "fallbacks": 0, "shards_searched": 0})
+
+    def select_shards(self, query: str) -> list:
+        names = self.router.route(query) if self.router is not None else None
+        if names is None:
+            shards = self.shards
+        else:
+            shards = [shard for shard in self.shards if shard.name in names]
+        self._counts["shards_searched"] += len(shards)
+        return shards
+
+    def query_matrix(self, vectors: list) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype="float32")
+        if self.shards and self.shards[0].store._normalize_L2:
+            faiss.normalize_L2(matrix)
+        return matrix
+
+    def lexical_search(self, query: str, k: int, shards: list = None) -> list:
+        shards = self.select_shards(query) if shards is None else shards
+        with stage("bm25"):
+            hits = fan_out(shards, lambda shard: shard.lexical_search(query, k))
+        return top_hits(hits, k)
+
+    def lexical_search_many(self, queries: list, k: int, routes: list) -> list:
+        return [self.lexical_search(query, k, shards) for query, shards in zip(queries, routes)]
+
+    def vector_search(self, query: str, embedding: list, shards: list) -> list:
+        fetch_k = self.k * 2 if self.mode == "hybrid" else self.k
+        matrix = self.query_matrix([embedding])
+        with stage("search"):
+            hits = fan_out(shards, lambda shard: shard.vector_search(matrix, fetch_k)[0])
+            vector_docs = top_hits(hits, fetch_k)
+        self._counts[self.mode] += 1
+        if self.mode == "hybrid":
+            return reciprocal_rank_fusion([vector_docs, self.lexical_search(query, fetch_k, shards)], self.k)
+        return vector_docs
+
+    def _vector_available(self) -> bool:
+        return time.monotonic() >= self._vector_down_until
+
+    def _vector_failed(self, error: Exception):
+        self._vector_down_until = time.monotonic() + self.fallback_cooldown
+        self._counts["fallbacks"] += 1
+        reason = "timed out" if isinstance(error, asyncio.TimeoutError) else f"failed ({error})"
+        print(f"[RETRIEVAL] Query embedding {reason}; using BM25 for the next {self.fallback_cooldown:.0f}s")
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> list[Document]:
+        shards = self.select_shards(query)
+        annotate("shards", len(shards))
+        if self.mode == "lexical" or not self._vector_available():
+            self._counts["lexical"] += 1
+            return self.lexical_search(query, self.k, shards)
+
+        try:
+            with stage("embed"):
+                embedding = self.embeddings.embed_query(query)
+        except Exception as e:
+            self._vector_failed(e)
+            self._counts["lexical"] += 1
+            return self.lexical_search(query, self.k, shards)
+
+        return self.vector_search(query, embedding, shards)
+
+    async def aembed_query(self, query: str):
+        """
+        The query's embedding, or None if embeddings are not being used or the
+        call fails or takes longer than embedding_timeout, which starts the
+        fallback cooldown. Other embedding-based steps (the semantic answer
+        cache) embed through this so they fall back together with retrieval.
+        """
+        if not self.embeddings_available():
+            return None
+        try:
+            return await asyncio.wait_for(self.embeddings.aembed_query(query), timeout=self.embedding_timeout)
+        except Exception as e:
+            self._vector_failed(e)
+            return None
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> list[Document]:
+        shards = self.select_shards(query)
+        annotate("shards", len(shards))
+        if self.mode == "lexical" or not self._vector_available():
+            self._counts["lexical"] += 1
+            return await asyncio.to_thread(self.lexical_search, query, self.k, shards)
+
+        with stage("embed"):
+            embedding = await self.aembed_query(query)
+        if embedding is None:
+            self._counts["lexical"] += 1
+            return await asyncio.to_thread(self.lexical_search, query, self.k, shards)
+
+        # FAISS and BM25 release the GIL: search in a thread, not on the event loop
+        return await asyncio.to_thread(self.vector_search, query, embedding, shards)
+
+    def search_many(self, vectors: list, k: int, routes: list = None) -> list:
+        """
+        Nearest chunks for each query vector. routes holds the shards to
+        search for each query (default: all). Each shard is searched once,
+        with the matrix of the queries routed to it, and shards are searched
+        in parallel.
+        """
+        matrix = self.query_matrix(vectors)
+        routes = routes or [self.shards] * len(matrix)
+        rows = {shard.name: [i for i, shards in enumerate(routes) if shard in shards] for shard in self.shards}
+        searched = [shard for shard in self.shards if rows[shard.name]]
+
+        hits = [[] for _ in range(len(matrix))]
+        results = fan_out(searched, lambda shard: shard.vector_search(matrix[rows[shard.name]], k))
+        for shard, shard_hits in zip(searched, results):
+            for i, row_hits in zip(rows[shard.name], shard_hits):
+                hits[i].append(row_hits)
+        return [top_hits(hit_lists, k) for hit_lists in hits]
+
+    async def abatch_retrieve(self, queries: list) -> list:
+        """
+        Documents for many queries at once: the queries are embedded in one
+        batched request and searched together. Falls back to BM25 like a
+        single query, but without a timeout, since large batches take a while
+        to embed.
+        """
+        if not queries:
+            return []
+        routes = [self.select_shards(query) for query in queries]
+        if self.mode == "lexical" or not self._vector_available():
+            self._counts["lexical"] += len(queries)
+            return await asyncio.to_thread(self.lexical_search_many, queries, self.k, routes)
+
+        fetch_k = self.k * 2 if self.mode == "hybrid" else self.k
+        embed_queries = getattr(self.embeddings, "aembed_queries", self.embeddings.aembed_documents)
+        try:
+            with stage("embed"):
+                vectors = await embed_queries(queries)
+        except Exception as e:
+            self._vector_failed(e)
+            self._counts["lexical"] += len(queries)
+            return await asyncio.to_thread(self.lexical_search_many, queries, self.k, routes)
+
+        with stage("search"):
+            # FAISS releases the GIL, so a large search doesn't stall the event loop
+            results = await asyncio.to_thread(self.search_many, vectors, fetch_k, routes)
+        self._counts[self.mode] += len(queries)
+        if self.mode == "hybrid":
+            lexical_results = await asyncio.to_thread(self.lexical_search_many, queries, fetch_k, routes)
+            return [
+                reciprocal_rank_fusion([vector_docs, lexical_docs], self.k)
+                for vector_docs, lexical_docs in zip(results, lexical_results)
+            ]
+        return results
+
+    def embeddings_available(self) -> bool:
+        """
+        False when query embeddings are not being used (lexical mode or cooldown),
+        so callers can skip other embedding-based steps too.
+        """
+        return self.mode != "lexical" and self._vector_available()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "vector_available": self._vector_available(),
+            "shards": len(self.shards),
+            **self._counts,
+            "routing": self.router.stats() if self.router is not None else None,
+        }
+
+
+def load_shard(name: str, compact_dir: Path) -> Shard:
+    store = load_compact(compact_dir, get_embeddings())
+    if not is_lexical_index(compact_dir):
+        # Compact indexes written before BM25 support
+        print(f"[BM25] Building lexical index from the compact docstore of {compact_dir.name}...")
+        docstore = store.docstore
+        BM25Index.build([docstore.search(str(i)).page_content for i in range(len(docstore))]).save(compact_dir)
+    return Shard(name=name, store=store, lexical=BM25Index.load(compact_dir))
+
+
+def load_retriever(compact_dir: Path) -> HybridRetriever:
+    """
+    Loads a compact or sharded index version.
+    """
+    if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown RETRIEVAL_MODE '{RETRIEVAL_MODE}', expected one of {RETRIEVAL_MODES}")
+
+    router = None
+    if is_sharded_index(compact_dir):
+        print(f"[FAISS] Loading memory-mapped sharded index {compact_dir.name}...")
+        entries = read_shards(compact_dir)["shards"]
+        shards = [load_shard(entry["name"], compact_dir / SHARDS_DIRNAME / entry["name"]) for entry in entries]
+        if SHARD_ROUTING and len(shards) > 1:
+            router = ShardRouter.from_shards(entries, load_curated_aliases())
+        sizes = ", ".join(f"{entry['name']} ({entry['count']})" for entry in entries)
+        print(f"[FAISS] {len(shards)} shards: {sizes}")
+    else:
+        print(f"[FAISS] Loading memory-mapped compact index {compact_dir.name}...")
+        shards = [load_shard("all", compact_dir)]
+
+    terms = sum(len(shard.lexical.vocab) for shard in shards)
+    routing = f", routing on {router.stats()['phrases']} titles and names" if router is not None else ""
+    print(f"[BM25] Lexical index ready ({terms} terms), retrieval mode: {RETRIEVAL_MODE}{routing}")
+
+    return HybridRetriever(
+        shards=shards,
+        embeddings=shards[0].store.embeddings if shards else get_embeddings(),
+        router=router,
+        mode=RETRIEVAL_MODE,
+        version=compact_dir.name,
+    )
+
+
 def build_retriever():
     """
     Builds or loads a persisted FAISS retriever using OpenAI embeddings.
-    Priority: 1) Local cache, 2) Google Drive, 3) Generate new
+    Priority: 1) Local compact index, 2) Local cache, 3) Google Drive, 4) Generate new
+
+    Pickled indexes (local or from Drive) are converted to the compact format
+    once, so later starts never unpickle the docstore.
     """
 
-    embeddings = OpenAIEmbeddings(model='text-embedding-3-small', chunk_size=100)
+    embeddings = get_embeddings()
+
+    FAISS_PATH = INDEX_DIR
+    compact_dir = current_compact_dir(FAISS_PATH)
 
-    FAISS_PATH = Path("faiss_index")
+    if compact_dir is not None:
+        return load_retriever(compact_dir)
 
     # Try to load from local cache first
-    if FAISS_PATH.exists() and (FAISS_PATH / "index.faiss").exists():
+    if (FAISS_PATH / "index.faiss").exists() and (FAISS_PATH / "index.pkl").exists():
         print("[FAISS] Loading index from local cache...")
         vector = FAISS.load_local(str(FAISS_PATH), embeddings, allow_dangerous_deserialization=True)
     else:
@@ -46,23 +398,14 @@ def build_retriever():
             # Generate new index
             print("[FAISS] No index in Drive. Generating new FAISS index...")
             print("[FAISS] Remember to manually upload the generated index to Google Drive!")
-            chunks = load_and_chunk_documents()
-            batch_size = 1000
-            all_vectors = None
-            for i in tqdm(range(0, len(chunks), batch_size)):
-                batch = chunks[i:i+batch_size]
-                batch_vector = FAISS.from_documents(batch, embeddings)
-                if all_vectors is None:
-                    all_vectors = batch_vector
-                else:
-                    all_vectors.merge_from(batch_vector)
-            
-            # Save locally
-            all_vectors.save_local(str(FAISS_PATH))
-            vector = all_vectors
+            vector = asyncio.run(build_index(FAISS_PATH, embeddings=embeddings))
             print(f"[FAISS] Index saved to {FAISS_PATH}")
             print(f"[FAISS] Upload these files to Google Drive (faiss_index folder):")
             print(f"   - {FAISS_PATH}/index.faiss")
             print(f"   - {FAISS_PATH}/index.pkl")
 
-    return vector.as_retriever(search_kwargs={"k": 4})
\ No newline at end of file
+    compact_dir = current_compact_dir(FAISS_PATH)
+    if compact_dir is None:
+        compact_dir = publish_compact(vector, FAISS_PATH, IndexSpec.from_env())
+    # Reload from the compact copy so the unpickled docstore can be freed
+    return load_retriever(compact_dir)
\ No newline at end of file
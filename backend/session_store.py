@@ -0,0 +1,105 @@
+"""
+Server-side chat history, so clients only send the new question.
+
+SessionHistoryStore keeps the last max_turns turns of recently active
+sessions in an LRU of at most max_sessions entries. A session that is not in
+memory is loaded once from the chat_history table (using the
+(session_id, created_at, id) index); concurrent requests for the same session
+share that load. New turns are appended in memory as soon as they are
+answered, while the row itself goes through the normal chat history writer.
+
+Entries expire after ttl_seconds so that, with several workers and no
+sticky sessions, a worker's copy of a session cannot lag for long behind
+turns answered by another worker.
+"""
+from collections import OrderedDict
+from sqlalchemy import select
+from models import ChatHistory
+import asyncio
+import time
+
+
+class SessionHistoryStore:
+    def __init__(self, session_factory, max_sessions: int = 10000, max_turns: int = 10, ttl_seconds: float = 600):
+        self.session_factory = session_factory
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+
+        # session_id -> (loaded_at, [(question, answer), ...]) oldest turn first
+        self._sessions = OrderedDict()
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def _load(self, session_id: str) -> list:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(ChatHistory.user_message, ChatHistory.bot_response)
+                .where(ChatHistory.session_id == session_id)
+                .order_by(ChatHistory.created_at.desc(), ChatHistory.id.desc())
+                .limit(self.max_turns)
+            )
+            turns = [(question, answer) for question, answer in result.all()][::-1]
+        self._put(session_id, turns)
+        return turns
+
+    def _put(self, session_id: str, turns: list, loaded_at: float = None):
+        self._sessions[session_id] = (loaded_at or time.monotonic(), turns[-self.max_turns:])
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def _cached(self, session_id: str):
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl_seconds:
+            del self._sessions[session_id]
+            return None
+        self._sessions.move_to_end(session_id)
+        return entry[1]
+
+    async def get_turns(self, session_id: str) -> list:
+        turns = self._cached(session_id)
+        if turns is not None:
+            self.hits += 1
+            return list(turns)
+
+        self.misses += 1
+        loading = self._loading.get(session_id)
+        if loading is None:
+            loading = self._loading[session_id] = asyncio.ensure_future(self._load(session_id))
+            loading.add_done_callback(lambda _: self._loading.pop(session_id, None))
+        # Shielded so one cancelled request does not abort the load for the others
+        return list(await asyncio.shield(loading))
+
+    async def get(self, session_id: str) -> list:
+        """
+        Returns the session's recent history as (role, content) pairs, oldest first.
+        """
+        history = []
+        for question, answer in await self.get_turns(session_id):
+            history.append(("user", question))
+            history.append(("assistant", answer))
+        return history
+
+    def append(self, session_id: str, question: str, answer: str):
+        turns = self._cached(session_id)
+        if turns is None:
+            # Not loaded here; the next read fetches it, including this turn once written
+            return
+        # Keep the load time, so the TTL still bounds staleness for active sessions
+        self._put(session_id, turns + [(question, answer)], loaded_at=self._sessions[session_id][0])
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
@@ -0,0 +1,183 @@
+"""
+Routing questions to the index shards of the works they mention.
+
+Each shard of a sharded index (see sharded_index.py) holds the chunks of one
+source file, usually one book. When a shard is exported it is given:
+
+- titles: from the Project Gutenberg "Title:" line and from the file name
+- names: capitalized words that are frequent in the shard and rare in every
+  other one, which are mostly its characters (Raskolnikov, Alyosha, Myshkin)
+
+shard_aliases.json (SHARD_ALIASES_PATH) adds hand-written aliases, such as
+translated titles and nicknames, to the shard whose title matches one of an
+entry's titles. It is read when the index is loaded, so editing it needs no
+rebuild.
+
+ShardRouter.route returns the shards whose titles, names or aliases occur in
+a question as whole words, ignoring case and accents. A question that
+mentions none of them, or all of them, returns None: search every shard.
+"""
+from collections import Counter
+from lexical_index import STOPWORDS
+from pathlib import Path
+import json
+import os
+import re
+import unicodedata
+
+SHARD_ALIASES_PATH = Path(os.getenv(
+    "SHARD_ALIASES_PATH",
+    str(Path(__file__).resolve().parent / "shard_aliases.json")
+))
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+TITLE_RE = re.compile(r"^\s*Title:\s*(.+?)\s*$", re.MULTILINE)
+ARTICLES = ("the", "a", "an")
+
+# Chunks searched for a "Title:" line, from the start of the file
+TITLE_CHUNKS = 5
+NAMES_PER_SHARD = 30
+# A name must be capitalized this often, appear this many times in its shard,
+# and have this share of its occurrences in the corpus there
+NAME_MIN_CAPITALIZED = 0.9
+NAME_MIN_COUNT = 10
+NAME_MIN_SHARE = 0.9
+
+
+def fold(text: str) -> str:
+    """
+    Casefolded, without accents: "Raskólnikov" and "raskolnikov" match.
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def words(text: str) -> list:
+    return WORD_RE.findall(fold(text))
+
+
+def title_keys(title: str) -> set:
+    """
+    The folded title, and without its leading article when at least two
+    words remain ("brothers karamazov", but not "idiot").
+    """
+    title_words = words(title)
+    keys = {" ".join(title_words)} if title_words else set()
+    if len(title_words) > 2 and title_words[0] in ARTICLES:
+        keys.add(" ".join(title_words[1:]))
+    return keys
+
+
+def shard_titles(source: str, texts: list) -> list:
+    """
+    Titles of a shard from its file name and from a "Title:" line in its
+    first chunks (texts in file order).
+    """
+    titles = {re.sub(r"[\W_]+", " ", Path(source or "").stem).strip()}
+    for text in texts[:TITLE_CHUNKS]:
+        match = TITLE_RE.search(text)
+        if match:
+            titles.add(match.group(1))
+            break
+    return sorted({key for title in titles for key in title_keys(title)})
+
+
+def distinctive_names(texts_by_shard: dict, per_shard: int = NAMES_PER_SHARD) -> dict:
+    """
+    {shard: [folded names]}, most frequent first, from {shard: [chunk texts]}.
+    """
+    capitalized, totals = {}, {}
+    for shard, texts in texts_by_shard.items():
+        forms = Counter()
+        for text in texts:
+            forms.update(WORD_RE.findall(text))
+        capitalized[shard], totals[shard] = Counter(), Counter()
+        for form, count in forms.items():
+            word = form.lower()
+            totals[shard][word] += count
+            if form[0].isupper():
+                capitalized[shard][word] += count
+
+    corpus = Counter()
+    for counts in capitalized.values():
+        corpus.update(counts)
+
+    names = {}
+    for shard, counts in capitalized.items():
+        candidates = [
+            (count, word) for word, count in counts.items()
+            if count >= NAME_MIN_COUNT
+            and len(word) >= 3
+            and not word.isdigit()
+            and word not in STOPWORDS
+            and count >= NAME_MIN_CAPITALIZED * totals[shard][word]
+            and count >= NAME_MIN_SHARE * corpus[word]
+        ]
+        names[shard] = list(dict.fromkeys(fold(word) for _, word in sorted(candidates, reverse=True)[:per_shard]))
+    return names
+
+
+def load_curated_aliases(path: Path = SHARD_ALIASES_PATH) -> list:
+    """
+    [{"titles": [...], "aliases": [...]}, ...], or [] if there is no file.
+    """
+    path = Path(path)
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ShardRouter:
+    def __init__(self, aliases: dict):
+        """
+        aliases maps each shard name to the phrases that route to it.
+        """
+        self.shards = frozenset(aliases)
+        self._phrases = {}
+        for shard, phrases in aliases.items():
+            for phrase in phrases:
+                key = tuple(words(phrase))
+                if key:
+                    self._phrases.setdefault(key[0], set()).add((key, shard))
+        self.routed = 0
+        self.unrouted = 0
+
+    @classmethod
+    def from_shards(cls, entries: list, curated: list = ()):
+        """
+        Builds the router from shards.json entries and curated aliases.
+        """
+        aliases = {}
+        for entry in entries:
+            titles = {key for title in entry.get("titles", []) for key in title_keys(title)}
+            phrases = set(titles) | set(entry.get("names", []))
+            for work in curated:
+                work_titles = {key for title in work.get("titles", []) for key in title_keys(title)}
+                if titles & work_titles:
+                    phrases |= work_titles | set(work.get("aliases", []))
+            aliases[entry["name"]] = sorted(phrases)
+        return cls(aliases)
+
+    def route(self, question: str):
+        """
+        Sorted names of the shards the question mentions, or None for all.
+        """
+        tokens = words(question)
+        matched = set()
+        for i, token in enumerate(tokens):
+            for phrase, shard in self._phrases.get(token, ()):
+                if tuple(tokens[i:i + len(phrase)]) == phrase:
+                    matched.add(shard)
+        if not matched or matched == self.shards:
+            self.unrouted += 1
+            return None
+        self.routed += 1
+        return sorted(matched)
+
+    def stats(self) -> dict:
+        return {
+            "phrases": sum(len(phrases) for phrases in self._phrases.values()),
+            "routed": self.routed,
+            "unrouted": self.unrouted,
+        }
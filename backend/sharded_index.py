@@ -0,0 +1,151 @@
+"""
+Per-source shards of the compact index.
+
+A sharded index directory holds one compact index (see compact_index.py) per
+source file, and a list of them:
+
+    shards.json     format version, vector count, index spec and, per shard:
+                    name, source, chunk count, fingerprint, and the titles
+                    and names it is routed by (see shard_router.py)
+    shards/<name>/  compact index of the source's chunks
+
+A shard's fingerprint hashes its chunk IDs, which depend only on the file's
+content, together with the index spec. Exporting a new version hard-links
+every shard whose fingerprint is unchanged from the previous version, and
+exports only new or changed ones: adding a book writes that book's shard.
+"""
+from langchain_community.vectorstores import FAISS
+from compact_index import COMPACT_FORMAT_VERSION, export_compact
+from index_types import IndexSpec
+from shard_router import distinctive_names, shard_titles
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import shutil
+
+SHARDS_FORMAT_VERSION = 1
+SHARDS_NAME = "shards.json"
+SHARDS_DIRNAME = "shards"
+
+
+def is_sharded_index(index_dir: Path) -> bool:
+    return (Path(index_dir) / SHARDS_NAME).exists()
+
+
+def read_shards(index_dir: Path) -> dict:
+    with open(Path(index_dir) / SHARDS_NAME, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def sharded_index_spec(index_dir: Path):
+    """
+    Returns the IndexSpec a sharded index was built with, or None if there is none.
+    """
+    if not is_sharded_index(index_dir):
+        return None
+    return IndexSpec.from_dict(read_shards(index_dir).get("index", {}))
+
+
+def shard_name(source: str, taken: set) -> str:
+    name = re.sub(r"[^\w-]+", "_", Path(source or "unknown").stem).strip("_").lower() or "shard"
+    unique, suffix = name, 2
+    while unique in taken:
+        unique, suffix = f"{name}_{suffix}", suffix + 1
+    return unique
+
+
+def shard_fingerprint(chunk_ids: list, spec: IndexSpec) -> str:
+    digest = hashlib.sha256(json.dumps([COMPACT_FORMAT_VERSION, spec.to_dict()]).encode("utf-8"))
+    for chunk_id in chunk_ids:
+        digest.update(b"\0" + str(chunk_id).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def link_tree(source_dir: Path, out_dir: Path):
+    """
+    Hard-links the files of source_dir into out_dir, copying where linking
+    is not possible (another filesystem).
+    """
+    out_dir.mkdir(parents=True)
+    for path in source_dir.iterdir():
+        try:
+            os.link(path, out_dir / path.name)
+        except OSError:
+            shutil.copy2(path, out_dir / path.name)
+
+
+def export_sharded(store: FAISS, out_dir: Path, spec: IndexSpec = None, previous_dir: Path = None) -> Path:
+    """
+    Writes a FAISS vector store as one compact index per source, replacing
+    out_dir atomically. Shards unchanged since the sharded index in
+    previous_dir are linked from it.
+    """
+    out_dir = Path(out_dir)
+    spec = spec or IndexSpec()
+    count = store.index.ntotal
+
+    groups = {}
+    for position in range(count):
+        doc = store.docstore.search(store.index_to_docstore_id[position])
+        groups.setdefault(doc.metadata.get("source"), []).append((doc.metadata.get("start_index", -1), position, doc))
+
+    previous = {}
+    if previous_dir is not None and is_sharded_index(previous_dir):
+        previous = {entry["fingerprint"]: entry["name"] for entry in read_shards(previous_dir)["shards"]}
+
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    (tmp_dir / SHARDS_DIRNAME).mkdir(parents=True)
+
+    entries, texts, taken, reused = [], {}, set(), 0
+    for source, members in sorted(groups.items(), key=lambda item: str(item[0])):
+        # File order, so the title page comes first
+        members.sort(key=lambda member: (member[0] if member[0] is not None else -1, member[1]))
+        positions = [position for _, position, _ in members]
+        fingerprint = shard_fingerprint([store.index_to_docstore_id[position] for position in positions], spec)
+        name = shard_name(source, taken)
+        taken.add(name)
+        texts[name] = [doc.page_content for _, _, doc in members]
+
+        shard_dir = tmp_dir / SHARDS_DIRNAME / name
+        if fingerprint in previous and (Path(previous_dir) / SHARDS_DIRNAME / previous[fingerprint]).is_dir():
+            link_tree(Path(previous_dir) / SHARDS_DIRNAME / previous[fingerprint], shard_dir)
+            reused += 1
+        else:
+            export_compact(store, shard_dir, spec, positions)
+        entries.append({
+            "name": name,
+            "source": source,
+            "author": members[0][2].metadata.get("author"),
+            "count": len(positions),
+            "fingerprint": fingerprint,
+            "titles": shard_titles(source, texts[name]),
+        })
+
+    # Names depend on the whole corpus: a new book can make an old name ambiguous
+    names = distinctive_names(texts)
+    for entry in entries:
+        entry["names"] = names[entry["name"]]
+
+    # Written last: its presence marks a complete index
+    with open(tmp_dir / SHARDS_NAME, "w", encoding="utf-8") as f:
+        json.dump({
+            "format": SHARDS_FORMAT_VERSION,
+            "count": count,
+            "index": spec.to_dict(),
+            "shards": entries,
+        }, f, ensure_ascii=False, indent=2)
+
+    old_dir = out_dir.with_name(out_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_dir.exists():
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    print(f"[SHARDS] Wrote {len(entries)} shards ({count} chunks) to {out_dir}: "
+          f"{len(entries) - reused} exported, {reused} unchanged and linked")
+    return out_dir
+
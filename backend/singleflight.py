@@ -0,0 +1,42 @@
+"""
+In-process request coalescing.
+
+SingleFlight runs at most one call per key at a time: a caller that arrives
+while a call for its key is in flight waits for that call's result instead
+of starting its own. It is used for first-turn answers (main.py), so a burst
+of the same opening question costs one embedding and one completion, and
+for query embeddings (embedding_cache.py).
+
+The shared call runs in its own task, shielded from the callers: one caller
+disconnecting does not cancel it for the others. Nothing is cached once the
+call completes; later callers start a new one.
+"""
+from metrics import COALESCED_CALLS, stage
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def run(self, key, fn, *args):
+        """
+        Returns await fn(*args), sharing the call with concurrent callers of the same key.
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            COALESCED_CALLS.labels(self.name).inc()
+            with stage(f"{self.name}_coalesced"):
+                return await asyncio.shield(call)
+
+        self.calls += 1
+        call = self._calls[key] = asyncio.ensure_future(fn(*args))
+        call.add_done_callback(lambda done: self._calls.pop(key, None) if self._calls.get(key) is done else None)
+        return await asyncio.shield(call)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "calls": self.calls, "saved_calls": self.shared}
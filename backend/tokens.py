@@ -0,0 +1,29 @@
+"""
+Token counting for prompt budgets.
+
+Uses the tokenizer of the chat model when tiktoken can load it, otherwise
+estimates about four characters per token (tiktoken downloads its encodings
+on first use, which fails on hosts without internet access).
+"""
+from functools import lru_cache
+
+TOKEN_ENCODING = "o200k_base"  # gpt-4o family
+
+
+@lru_cache(maxsize=1)
+def get_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        print(f"[TOKENS] Could not load {TOKEN_ENCODING} ({e}), estimating token counts")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))